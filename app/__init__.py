@@ -6,6 +6,11 @@ from flask_socketio import SocketIO
 from json import dumps
 from functools import partial
 from config import Config, ALLOWED_IMG_EXT
+from .pubsub import LocalSocketManager
+from .presence import Presence
+from .storage import Storage
+from .thumbnails import Thumbnails
+from .cache import ResponseCache
 
 json_config = {'ensure_ascii': False, 'indent': None, 'separators': (',', ':')}
 compact_dumps = partial(dumps, **json_config)
@@ -18,7 +23,11 @@ class CustomUpSet(UploadSet):
 
 
 db = SQLAlchemy()
+presence = Presence(socketio)
 up_files = CustomUpSet(name='FILES', extensions=ALLOWED_IMG_EXT)
+storage = Storage()
+thumbnails = Thumbnails(storage)
+response_cache = ResponseCache()
 
 
 def create_app():
@@ -26,7 +35,14 @@ def create_app():
     app.config.from_object(Config)
     db.init_app(app)
     configure_uploads(app, up_files)
-    socketio.init_app(app, async_mode='eventlet', cors_allowed_origins='*')
+    storage.init_app(app)
+    queue = app.config['SOCKETIO_MESSAGE_QUEUE']
+    queue_conf = {'message_queue': queue}
+    if queue and queue.startswith('local://'):
+        queue_conf = {'client_manager': LocalSocketManager(queue, channel='flask-socketio')}
+    socketio.init_app(app, async_mode='eventlet', cors_allowed_origins='*', **queue_conf)
+    presence.init_app(app)
+    response_cache.init_app(app)
     from .v1 import v1  # 不能在db初始化前，因为v1有用到db
     app.register_blueprint(v1, url_prefix='/v1')
     from .main import main
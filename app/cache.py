@@ -0,0 +1,92 @@
+from flask import request, current_app
+from collections import OrderedDict, Counter
+from json import dumps, loads
+from time import time
+
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_LOG_EVERY
+
+
+class ResponseCache(object):
+    """
+    读多写少接口的响应数据缓存，键为 资源:团队id:团队版本号:请求URL(响应中的链接含主机名)
+    团队有变更时版本号加一(见 Team.touch)，旧键不再命中，自然淘汰，多个worker间也不会读到旧数据
+    默认存于进程内LRU；配置 RESPONSE_CACHE_REDIS_URL 后存于redis，多个worker共享
+    命中/未命中次数按资源计于本进程，每 log_every 次查询以INFO级别记入 app.logger 一次(0 则不记)
+    """
+
+    def __init__(self, app=None, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, log_every=RESPONSE_CACHE_LOG_EVERY):
+        self.maxsize = maxsize
+        self.ttl = ttl  # 版本号之外的兜底，防止直接改库等情况
+        self.log_every = log_every
+        self._lookups = 0
+        self._data = OrderedDict()
+        self._redis = None
+        self.hits = Counter()
+        self.misses = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = app.config.get('RESPONSE_CACHE_REDIS_URL')
+        if url:
+            import redis  # 仅多worker部署时需要
+            self._redis = redis.StrictRedis.from_url(url)
+
+    def get_or_build(self, resource, tid, version, build):
+        """取缓存的响应数据，未命中则调用 build() 生成并存入"""
+
+        self._lookups += 1
+        if self.log_every and self._lookups % self.log_every == 0:
+            current_app.logger.info('response cache: %s', self.stats())
+
+        key = f'resp:{resource}:{tid}:{version}:{request.url}'
+        data = self._get(key)
+        if data is not None:
+            self.hits[resource] += 1
+            return data
+
+        self.misses[resource] += 1
+        data = build()
+        self._set(key, data)
+        return data
+
+    def stats(self):
+        """{资源: {'hits', 'misses', 'hit_rate'}}"""
+        result = {}
+        for resource in self.hits.keys() | self.misses.keys():
+            hits, misses = self.hits[resource], self.misses[resource]
+            result[resource] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3)}
+        return result
+
+    def clear(self):
+        self._data.clear()
+        self._lookups = 0
+        self.hits.clear()
+        self.misses.clear()
+
+    def _get(self, key):
+        if self._redis is not None:
+            value = self._redis.get(key)
+            return None if value is None else loads(value)
+
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        data, expire = item
+        if expire <= time():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return data
+
+    def _set(self, key, data):
+        if self._redis is not None:
+            self._redis.setex(key, self.ttl, dumps(data, ensure_ascii=False, separators=(',', ':')))
+            return
+
+        self._data[key] = (data, time() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
@@ -1,22 +1,192 @@
+from flask import current_app, session, request
 from flask_socketio import Namespace, join_room, leave_room, emit, rooms
-from .. import socketio, db
-from ..models import Team, User
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, DataError
+from .. import socketio, db, compact_dumps, presence
+from ..models import User, Message, t_users
+
+from config import CHAT_FLUSH_SIZE, CHAT_FLUSH_INTERVAL, CHAT_FLUSH_RETRIES, CHAT_MAX_PENDING
+from config import CHAT_BATCH_WINDOW, CHAT_MAX_PAYLOAD
+from datetime import datetime
+
+
+class MessageBuffer(object):
+    """
+    聊天记录的写后缓冲：攒够 size 条或每隔 interval 毫秒批量写入一次
+    写库在后台任务中进行，转发消息时不必等待数据库
+    整批因某些行本身有误(如团队已删除、内容超长)而失败时逐条重写，丢弃并记录坏行；
+    其他错误(如连接断开)整批留待重试，连续失败 retries 次后丢弃；积压超过 max_pending 条时丢弃最旧的
+    """
+
+    def __init__(self, size=CHAT_FLUSH_SIZE, interval=CHAT_FLUSH_INTERVAL,
+                 retries=CHAT_FLUSH_RETRIES, max_pending=CHAT_MAX_PENDING):
+        self.size = size
+        self.interval = interval / 1000
+        self.retries = retries
+        self.max_pending = max_pending
+        self._pending = []
+        self._failures = 0
+        self._app = None
+
+    def push(self, tid, uid, content):
+        if self._app is None:
+            self._app = current_app._get_current_object()
+            socketio.start_background_task(self._run)
+
+        self._pending.append({'team_id': tid, 'uid': uid, 'content': content, 'datetime': datetime.now()})
+        self._trim()
+        if len(self._pending) >= self.size:
+            socketio.start_background_task(self.flush)
+
+    def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        with self._app.app_context():
+            try:
+                self._insert(batch)
+            except (IntegrityError, DataError):
+                db.session.rollback()
+                self._insert_each(batch)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self._retry(batch, e)
+            else:
+                self._failures = 0
+
+    def _insert(self, rows):
+        db.session.execute(Message.__table__.insert(), rows)
+        db.session.commit()
+
+    def _insert_each(self, batch):
+        for i, row in enumerate(batch):
+            try:
+                self._insert([row])
+            except (IntegrityError, DataError) as e:
+                db.session.rollback()
+                self._app.logger.error('chat message dropped (team %s, uid %s): %s', row['team_id'], row['uid'], e)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                self._retry(batch[i:], e)
+                return
+        self._failures = 0
+
+    def _retry(self, batch, error):
+        self._failures += 1
+        if self._failures > self.retries:
+            self._app.logger.error('%d chat messages dropped after %d failed flushes: %s',
+                                   len(batch), self._failures, error)
+            self._failures = 0
+            return
+        self._pending[:0] = batch  # 留待下次重试
+        self._trim()
+
+    def _trim(self):
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self._app.logger.error('chat buffer full, %d oldest messages dropped', overflow)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.interval)
+            self.flush()
+
+
+class ChatBatcher(object):
+    """
+    大团队消息密集时，把同一房间 window 毫秒内的消息合并为一个 chat_batch 事件转发
+    每个成员收到的包数由 消息数 降为 窗口数
+    """
+
+    def __init__(self, window=CHAT_BATCH_WINDOW, namespace='/chat'):
+        self.window = window / 1000
+        self.namespace = namespace
+        self._rooms = {}
+
+    def push(self, tid, data):
+        batch = self._rooms.get(tid)
+        if batch is None:
+            batch = self._rooms[tid] = []
+            socketio.start_background_task(self._emit_later, tid)
+        batch.append(data)
+
+    def _emit_later(self, tid):
+        socketio.sleep(self.window)
+        batch = self._rooms.pop(tid, None)
+        if batch:
+            socketio.emit('chat_batch', batch, room=tid, namespace=self.namespace)
+
+
+message_buffer = MessageBuffer()
+chat_batcher = ChatBatcher() if CHAT_BATCH_WINDOW > 0 else None
+
+
+def user_room(uid):
+    return f'user:{uid}'
+
+
+def load_teams(uid):
+    """
+    查一次所在团队存进该连接的session，并加入该用户的私有房间
+    该房间被关闭(见 memberships_changed)即表示所在团队有变，下次join时重新载入
+    """
+    session['teams'] = {tid for tid, in db.session.query(t_users.c.team_id).filter(t_users.c.user_id == uid)}
+    join_room(user_room(uid))
+
+
+def memberships_changed(*uids):
+    """团队成员变动提交后调用，经消息队列通知所有worker上这些用户的连接"""
+    for uid in uids:
+        socketio.close_room(user_room(uid), namespace='/chat')
+
+
+def authenticate(token):
+    """验证令牌(只校验签名)，把用户id及其所在团队存进该连接的session，返回是否成功"""
+
+    data, _ = User.load_auth_token(token)
+    if data is None:
+        return False
+
+    session['uid'] = data['uid']
+    load_teams(data['uid'])
+    return True
+
+
+def is_member(tid):
+    uid = session['uid']
+    if user_room(uid) not in rooms():
+        load_teams(uid)
+    return tid in session['teams']
 
 
 class ChatRoom(Namespace):
     def __init__(self, namespace):
         super().__init__(namespace)
 
+    def on_connect(self):
+        """连接时带 ?token= 则在此一次性认证；不带的旧客户端仍可在join时传token"""
+
+        token = request.args.get('token')
+        if token is not None and not authenticate(token):
+            return False  # 拒绝连接
+
     def on_join(self, data):
         tid = data.pop('tid', 0)
-        team = Team.query.get_or_404(tid)
-        user = User.verify_auth_token(data.pop('token', ''))
+        token = data.pop('token', None)
+
+        if 'uid' not in session and not (token and authenticate(token)):
+            return
 
-        if not user or not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
+        if not is_member(tid):
+            # 平时不查库；连接期间被移出团队的用户不能再进入
             return
 
         join_room(tid)
-        emit('enter', {'uid': user.id}, broadcast=True, room=tid)
+        if presence.join(tid, session['uid'], request.sid):
+            # 同一用户的其他标签页已在房间内时不再重复广播
+            emit('enter', {'uid': session['uid']}, broadcast=True, room=tid)
+        emit('online', {'tid': tid, 'uids': presence.online(tid)})
 
     def on_leave(self, data):
         tid = data.pop('tid', 0)
@@ -24,15 +194,43 @@ class ChatRoom(Namespace):
             return
 
         leave_room(tid)
-        emit('exit', {'uid': data.get('uid')}, broadcast=True, room=tid)
+        uid = presence.leave(tid, request.sid)
+        if uid is not None:
+            emit('exit', {'uid': uid}, broadcast=True, room=tid)
+
+    def on_disconnect(self):
+        for tid, uid in presence.disconnect(request.sid):
+            emit('exit', {'uid': uid}, broadcast=True, room=tid)
+
+    def on_online(self, data):
+        """查询房间当前在线的成员"""
+
+        tid = data.get('tid', 0)
+        if tid not in rooms():
+            return
+        emit('online', {'tid': tid, 'uids': presence.online(tid)})
 
     def on_chat(self, data):
-        """原样转发客户端发送的json"""
+        """
+        转发客户端发送的json(uid以服务器认证的为准)，并交给缓冲写入聊天记录
+        开启合并转发时，房间内收到的是 chat_batch 事件，内容为消息列表
+        消息过长时不转发，以ack返回错误
+        """
 
         tid = data.get('tid', 0)
         if tid not in rooms():
             return
-        emit('chat', data, broadcast=True, room=tid)  # , include_self=False
+
+        data['uid'] = session.get('uid')
+        content = compact_dumps(data)
+        if len(content.encode()) > CHAT_MAX_PAYLOAD:
+            return {'code': 2002, 'message': '消息过长'}
+
+        if chat_batcher is None:
+            emit('chat', data, broadcast=True, room=tid)  # , include_self=False
+        else:
+            chat_batcher.push(tid, data)
+        message_buffer.push(tid, data['uid'], content)
 
 
 socketio.on_namespace(ChatRoom('/chat'))
@@ -1,11 +1,21 @@
+from flask import request
 from . import main
+from .. import storage, thumbnails
+
+from config import STATIC_MAX_AGE
 
 
 @main.route('/img/<string:avatar>')
 def get_avatar(avatar):
-    pass
+    """
+    头像文件名随用户固定、重新上传会覆盖，故不长期缓存，靠ETag验证
+    ?size= 为 AVATAR_SIZES 之一时返回该尺寸的缩略图，尚未生成则返回原图
+    """
+    avatar = thumbnails.lookup(avatar, request.args.get('size', type=int))
+    return storage.send(f'img/{avatar}')
 
 
 @main.route('/archives/<string:filename>')
 def get_archive(filename):
-    pass
+    """文件名为uuid且内容不再改变，可长期缓存"""
+    return storage.send(f'archives/{filename}', max_age=STATIC_MAX_AGE)
@@ -3,16 +3,27 @@ from config import Config, DEFAULT_AVATAR
 
 from sqlalchemy import Column, String, Integer
 from sqlalchemy import ForeignKey, Date, DateTime, Time
+from sqlalchemy import exists, and_, event
 from sqlalchemy.dialects.mysql import TINYINT, BOOLEAN, TEXT
 
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import SignatureExpired, BadSignature
 
-from passlib.apps import mysql_context as pwd_context
+from passlib.context import CryptContext
+from eventlet import tpool
 from secrets import token_urlsafe
 from time import time
 from datetime import datetime
 
+token_serializer = Serializer(Config.SECRET_KEY)
+# 验证令牌时复用，过期时间写在令牌头部，不依赖serializer自身的expires_in
+
+pwd_context = CryptContext(schemes=Config.PASSWORD_SCHEMES, deprecated='auto')
+if Config.PASSWORD_ROUNDS:
+    # 同时设为下限，调高后旧哈希在登录时重新计算
+    scheme = Config.PASSWORD_SCHEMES[0]
+    pwd_context.update(**{f'{scheme}__rounds': Config.PASSWORD_ROUNDS, f'{scheme}__min_rounds': Config.PASSWORD_ROUNDS})
+
 
 def object_alter(obj, kwargs):
     for k, v in kwargs.items():
@@ -24,9 +35,9 @@ def object_alter(obj, kwargs):
 class User(db.Model):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
-    email = Column(String(64), nullable=False)  # 但email最长可以到320位?
+    email = Column(String(64), unique=True, index=True, nullable=False)  # 但email最长可以到320位?
     username = Column(String(16), unique=True, nullable=False)
-    password_hash = Column(String(64), nullable=False)
+    password_hash = Column(String(128), nullable=False)
     name = Column(String(16), index=True)  # 昵称
     avatar = Column(String(40), default=DEFAULT_AVATAR)
 
@@ -34,33 +45,54 @@ class User(db.Model):
         super().__init__(**kwargs)
 
     def hash_password(self, password):
-        self.password_hash = pwd_context.encrypt(password)
+        self.password_hash = tpool.execute(pwd_context.hash, password)
 
     def verify_password(self, password):
-        return pwd_context.verify(password, self.password_hash)
+        """
+        哈希计算耗CPU，放到线程池中执行以免阻塞其他协程
+        验证通过而哈希的算法或参数已过时，则顺便更新 password_hash（由调用者提交）
+        """
+        ok, new_hash = tpool.execute(pwd_context.verify_and_update, password, self.password_hash)
+        if ok and new_hash:
+            self.password_hash = new_hash
+        return ok
 
     def generate_auth_token(self, expiration=3600):
         s = Serializer(Config.SECRET_KEY, expires_in=expiration)
         return s.dumps({'uid': self.id, 'time': time()})
 
     @staticmethod
-    def verify_auth_token(token):
-        s = Serializer(Config.SECRET_KEY)
+    def load_auth_token(token):
+        """仅校验令牌签名与有效期，返回 (载荷, 过期时间戳)，不访问数据库"""
         try:
-            data = s.loads(token)
+            data, header = token_serializer.loads(token, return_header=True)
         except SignatureExpired:
-            return None
+            return None, None
         except BadSignature:
+            return None, None
+        return data, header.get('exp', 0)
+
+    @staticmethod
+    def verify_auth_token(token):
+        data, _ = User.load_auth_token(token)
+        if data is None:
             return None
         return User.query.get(data['uid'])
 
 
 t_users = db.Table('t_users',
                    Column('team_id', Integer, db.ForeignKey('teams.id')),
-                   Column('user_id', Integer, db.ForeignKey('users.id'))
+                   Column('user_id', Integer, db.ForeignKey('users.id')),
+                   db.Index('ix_t_users_team_id_user_id', 'team_id', 'user_id', unique=True)
                    )
 # 关联表r； u -> v: 多->多; u,v -> r: 一->多
 
+
+def member_exists(team_id, uid):
+    """uid是否为团队成员的EXISTS子句，走(team_id, user_id)联合索引，可嵌入其他查询"""
+    return exists().where(and_(t_users.c.team_id == team_id, t_users.c.user_id == uid))
+
+
 foreign_conf = {'lazy': 'dynamic', 'passive_deletes': True, 'cascade': "all, delete-orphan"}
 # lazy使得查询时返回查询对象；passive_deletes/cascade用于级联删除
 # passive一般与受关联表中 ondelete='CASCADE'搭配，这两样一般可省 , cascade="all, delete-orphan"
@@ -75,18 +107,33 @@ class Team(db.Model):
     check_s = Column(Time, index=True)
     check_e = Column(Time, index=True)
     inv_code = Column(String(16), unique=True)  # 邀请码
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # 团队数据每变更一次加一，用作ETag
     users = db.relationship('User', secondary=t_users, backref='teams', lazy='dynamic')
     schedules = db.relationship('Schedule', backref='team', **foreign_conf)
     attendances = db.relationship('Attendance', backref='team', **foreign_conf)
+    attendance_stats = db.relationship('AttendanceDailyStat', backref='team', **foreign_conf)
     tasks = db.relationship('Task', backref='team', **foreign_conf)
     archives = db.relationship('Archive', backref='team', lazy='dynamic')
     questionnaires = db.relationship('Questionnaire', backref='team', **foreign_conf)
     logs = db.relationship('Log', backref='team', **foreign_conf)
+    messages = db.relationship('Message', backref='team', **foreign_conf)
 
     @property
     def tid(self):
         return self.id
 
+    def touch(self):
+        """版本号加一，由数据库在本次事务中自增，不必先读出"""
+        if self.id is not None:  # 新建的团队仍为默认的0
+            self.version = Team.version + 1
+
+    @staticmethod
+    def touch_joined(uid):
+        """成员资料变更会改变其所在各团队的成员列表"""
+        joined = db.session.query(t_users.c.team_id).filter(t_users.c.user_id == uid)
+        db.session.query(Team).filter(Team.id.in_(joined)).update(
+            {Team.version: Team.version + 1}, synchronize_session=False)
+
     def renew_inv_code(self):  # 16位base64，冲突可能性仅 1/2^256
         # while self.__class__.query.filter_by(inv_code=new_code).first():
         #     new_code = token_urlsafe(12)
@@ -105,15 +152,28 @@ class Schedule(db.Model):
 
 class Attendance(db.Model):
     __tablename__ = "attendances"
+    __table_args__ = (db.UniqueConstraint('team_id', 'date', 'uid', name='uq_attendances_team_id_date_uid'),)
+    # 每人每天仅一次打卡由数据库保证；team_id+date 前缀同时服务按天查询
     id = Column(Integer, primary_key=True)
     uid = Column(Integer, nullable=False)
     datetime = Column(DateTime, index=True, nullable=False)
+    date = Column(Date, nullable=False)  # 打卡日期，即datetime的日期部分
     punctual = Column(BOOLEAN, nullable=False)  # 以免将来团队更换打卡时间无从判断
     team_id = Column(Integer, ForeignKey('teams.id', ondelete='CASCADE'))
 
 
+class AttendanceDailyStat(db.Model):
+    __tablename__ = "attendance_daily_stats"
+    # 每个团队每天的打卡汇总，打卡时随之递增，避免每次查询都COUNT
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete='CASCADE'), primary_key=True)
+    date = Column(Date, primary_key=True)
+    present = Column(Integer, nullable=False, default=0)  # 已打卡人数
+    punctual = Column(Integer, nullable=False, default=0)  # 其中准时的人数
+
+
 class Task(db.Model):
     __tablename__ = "tasks"
+    __table_args__ = (db.Index('ix_tasks_team_id_datetime_id', 'team_id', 'datetime', 'id'),)  # 键集分页
     id = Column(Integer, primary_key=True)
     title = Column(String(32), nullable=False)
     desc = Column(String(64))
@@ -127,13 +187,15 @@ class Task(db.Model):
 
 class Archive(db.Model):
     __tablename__ = "archives"
+    __table_args__ = (db.Index('ix_archives_team_id_datetime_id', 'team_id', 'datetime', 'id'),)  # 键集分页
     id = Column(Integer, primary_key=True)
     name = Column(String(32))
     type = Column(TINYINT, nullable=False)  # 1-3分别代表.md/.rtf/others文件
     filename = Column(String(40), index=True, nullable=False)
     datetime = Column(DateTime, default=datetime.now)
-    content = Column(TEXT)  # 前两种直接存，第三种放空
+    content = db.deferred(Column(TEXT))  # 旧数据中前两种直接存于此，现已统一存为blob，仅在需要时加载
     # (1074, "Column length too big for column 'content' (max = 16383); use BLOB or TEXT instead")
+    blob = Column(String(80), index=True)  # 内容的 sha256.后缀，存于blob目录，内容相同的共用一份
     owner = Column(Integer, nullable=False)
     task_id = Column(Integer, ForeignKey('tasks.id', ondelete='CASCADE'))
     team_id = Column(Integer, ForeignKey('teams.id'))
@@ -141,6 +203,7 @@ class Archive(db.Model):
 
 class Questionnaire(db.Model):
     __tablename__ = "questionnaires"
+    __table_args__ = (db.Index('ix_questionnaires_team_id_datetime_id', 'team_id', 'datetime', 'id'),)  # 键集分页
     id = Column(Integer, primary_key=True)
     title = Column(String(32), nullable=False)
     desc = Column(String(128))
@@ -148,6 +211,7 @@ class Questionnaire(db.Model):
     deadline = Column(DateTime, nullable=False)
     questions = db.relationship('QQuestion', backref='questionnaire', **foreign_conf)
     records = db.relationship('QRecord', backref='questionnaire', **foreign_conf)
+    tallies = db.relationship('QTally', backref='questionnaire', **foreign_conf)
     team_id = Column(Integer, ForeignKey('teams.id', ondelete='CASCADE'))
 
 
@@ -192,10 +256,38 @@ class QAnswer(db.Model):
     record_id = Column(Integer, ForeignKey('q_records.id', ondelete='CASCADE'))
 
 
+class QTally(db.Model):
+    __tablename__ = "q_tallies"
+    # 选择题各选项被选次数，发布问卷时按选项建好(count=0)，提交时累加
+    questionnaire_id = Column(Integer, ForeignKey('questionnaires.id', ondelete='CASCADE'), primary_key=True)
+    qid = Column(TINYINT, primary_key=True, autoincrement=False)  # 题号
+    oid = Column(TINYINT, primary_key=True, autoincrement=False)  # 选项序号
+    count = Column(Integer, nullable=False, default=0)
+
+
 class Log(db.Model):
     __tablename__ = "logs"
+    __table_args__ = (db.Index('ix_logs_team_id_datetime_id', 'team_id', 'datetime', 'id'),)  # 键集分页
     id = Column(Integer, primary_key=True)
     uid = Column(Integer, nullable=False)  # 操作发出者
     desc = Column(String(64), nullable=False)
     datetime = Column(DateTime, default=datetime.now)
     team_id = Column(Integer, ForeignKey('teams.id', ondelete='CASCADE'))
+
+
+@event.listens_for(db.session, 'before_flush')
+def touch_logged_teams(session, flush_context, instances):
+    """写Log的操作都是对团队数据的变更，随之更新团队版本号"""
+    for obj in session.new:
+        if isinstance(obj, Log) and obj.team is not None:
+            obj.team.touch()
+
+
+class Message(db.Model):
+    __tablename__ = "messages"
+    __table_args__ = (db.Index('ix_messages_team_id_datetime_id', 'team_id', 'datetime', 'id'),)
+    id = Column(Integer, primary_key=True)
+    uid = Column(Integer)  # 发送者
+    content = Column(TEXT, nullable=False)  # 客户端发送的json原文
+    datetime = Column(DateTime, default=datetime.now)  # 服务器收到的时间，而非写入数据库的时间
+    team_id = Column(Integer, ForeignKey('teams.id', ondelete='CASCADE'))
@@ -0,0 +1,109 @@
+from time import time
+
+from config import PRESENCE_TTL
+
+
+class Presence(object):
+    """
+    聊天室在线成员登记：{tid: {uid: {sid, ...}}}，同一用户多个标签页(多个sid)只算一次在线
+    默认存于进程内存；配置 PRESENCE_REDIS_URL 后存于redis，多个worker共享
+    sid -> 房间 的对应只在本进程记录，用于断线时清理
+    redis中每个房间一个有序集合 presence:<tid>，成员为 <uid>:<sid>，分数为过期时间，
+    各进程在后台每 ttl/3 秒为本进程的连接续期；进程崩溃来不及清理时，其连接最多 ttl 秒后不再算作在线
+    """
+
+    def __init__(self, socketio, app=None, ttl=PRESENCE_TTL):
+        self.socketio = socketio
+        self.ttl = ttl
+        self._rooms = {}
+        self._sids = {}
+        self._redis = None
+        self._heartbeat = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        url = app.config.get('PRESENCE_REDIS_URL')
+        if url:
+            import redis  # 仅多worker部署时需要
+            self._redis = redis.StrictRedis.from_url(url, decode_responses=True)
+
+    def join(self, tid, uid, sid):
+        """返回该用户是否由此刚上线；同一连接重复加入同一房间不算"""
+        rooms = self._sids.setdefault(sid, {})
+        if rooms.get(tid) == uid:
+            return False
+        rooms[tid] = uid
+        return self._add(tid, uid, sid)
+
+    def leave(self, tid, sid):
+        """返回因此下线的uid，该用户仍有其他连接在房间内则返回None"""
+        uid = self._sids.get(sid, {}).pop(tid, None)
+        if uid is not None and self._remove(tid, uid, sid):
+            return uid
+        return None
+
+    def disconnect(self, sid):
+        """连接断开，返回因此下线的 [(tid, uid)]"""
+        rooms = self._sids.pop(sid, {})
+        return [(tid, uid) for tid, uid in rooms.items() if self._remove(tid, uid, sid)]
+
+    def online(self, tid):
+        if self._redis is not None:
+            members = self._redis.zrangebyscore(f'presence:{tid}', time(), '+inf')
+            return sorted({int(m.split(':', 1)[0]) for m in members})
+        return sorted(self._rooms.get(tid, {}))
+
+    def _add(self, tid, uid, sid):
+        if self._redis is not None:
+            self._start_heartbeat()
+            key, now = f'presence:{tid}', time()
+            pipe = self._redis.pipeline()
+            pipe.zadd(key, {f'{uid}:{sid}': now + self.ttl}).expire(key, self.ttl)
+            pipe.zremrangebyscore(key, '-inf', now).zrangebyscore(key, now, '+inf')
+            return self._count(pipe.execute()[3], uid) == 1
+
+        sids = self._rooms.setdefault(tid, {}).setdefault(uid, set())
+        sids.add(sid)
+        return len(sids) == 1
+
+    def _remove(self, tid, uid, sid):
+        if self._redis is not None:
+            key, now = f'presence:{tid}', time()
+            pipe = self._redis.pipeline()
+            pipe.zrem(key, f'{uid}:{sid}').zrangebyscore(key, now, '+inf')
+            return self._count(pipe.execute()[1], uid) == 0
+
+        users = self._rooms.get(tid, {})
+        sids = users.get(uid, set())
+        sids.discard(sid)
+        if sids:
+            return False
+        users.pop(uid, None)
+        if not users:
+            self._rooms.pop(tid, None)
+        return True
+
+    @staticmethod
+    def _count(members, uid):
+        prefix = f'{uid}:'
+        return sum(1 for m in members if m.startswith(prefix))
+
+    def _start_heartbeat(self):
+        if not self._heartbeat:
+            self._heartbeat = True
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.ttl / 3)
+            self.refresh()
+
+    def refresh(self):
+        """为本进程仍连接着的 sid 续期"""
+        expire = time() + self.ttl
+        pipe = self._redis.pipeline(transaction=False)
+        for sid, rooms in list(self._sids.items()):
+            for tid, uid in rooms.items():
+                pipe.zadd(f'presence:{tid}', {f'{uid}:{sid}': expire}).expire(f'presence:{tid}', self.ttl)
+        pipe.execute()
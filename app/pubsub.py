@@ -0,0 +1,66 @@
+from socketio import PubSubManager
+from os import makedirs, listdir, remove, getpid, getuid, stat, path
+from uuid import uuid4
+from json import dumps, loads
+import atexit
+import stat as st
+
+try:
+    from eventlet.green import socket  # eventlet下不阻塞事件循环
+except ImportError:
+    import socket
+
+
+class LocalSocketManager(PubSubManager):
+    """
+    单机多进程间转发Socket.IO广播的消息队列，无需redis等外部服务，也用于测试
+    url形如 local:///tmp/zenigame-sio，每个进程在该目录下绑定一个unix数据报socket，
+    发布时发送给目录下同一channel的所有socket(包括自己)
+    目录须归本用户所有且他人无权访问，否则其他本机用户可向各进程注入消息；消息以json编码而非pickle
+    """
+
+    name = 'local'
+
+    def __init__(self, url='local:///tmp/zenigame-sio', channel='socketio', write_only=False, logger=None):
+        self.dir = url[len('local://'):]
+        makedirs(self.dir, mode=0o700, exist_ok=True)
+        info = stat(self.dir)
+        if info.st_uid != getuid() or st.S_IMODE(info.st_mode) & 0o077:
+            raise ValueError(f'{self.dir} 须为当前用户所有且权限为0700')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addr = None
+
+        if not write_only:
+            self.addr = path.join(self.dir, f'{channel}-{getpid()}-{uuid4().hex[:8]}.sock')
+            self.sock.bind(self.addr)
+            atexit.register(self._unlink, self.addr)
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    @staticmethod
+    def _unlink(addr):
+        if path.exists(addr):
+            remove(addr)
+
+    def _publish(self, data):
+        message = dumps(data, separators=(',', ':')).encode()
+        prefix = self.channel + '-'
+
+        for name in listdir(self.dir):
+            if not name.startswith(prefix):
+                continue
+            addr = path.join(self.dir, name)
+            try:
+                self.sock.sendto(message, addr)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._unlink(addr)  # 对应进程已退出
+            except OSError as e:
+                # 如消息超过数据报上限(EMSGSIZE)，不影响发给其他进程
+                self._get_logger().error('local message queue: cannot send to %s: %s', addr, e)
+
+    def _listen(self):
+        # 交给基类的是已解码的dict，基类便不会对收到的字节尝试 pickle.loads
+        while True:
+            try:
+                yield loads(self.sock.recv(1 << 20))
+            except ValueError:
+                self._get_logger().error('local message queue: invalid message dropped')
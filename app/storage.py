@@ -0,0 +1,229 @@
+from flask import g, has_app_context, request, send_file, Response, abort
+from sqlalchemy import event
+from eventlet import sleep, spawn, tpool
+from collections import deque
+from os import fsync, replace, remove, path, link, makedirs, stat
+from mimetypes import guess_type
+from hashlib import sha256
+import zlib
+from uuid import uuid4
+
+
+class Storage(object):
+    """
+    上传文件的存取，与数据库事务同步：
+    保存时分块写入同目录下的临时文件并fsync，数据库提交后才原子重命名到位，回滚则删掉临时文件；
+    删除在提交后交给后台协程执行，失败会重试。避免大文件阻塞其他协程，也不会因回滚留下孤儿文件
+    save_blob 按内容去重：相同内容只存一份blob，各文件名只是指向它的硬链接
+    """
+
+    chunk_size = 64 * 1024
+    retries = 3
+    retry_interval = 1  # 秒
+
+    def __init__(self, app=None):
+        self.root = None
+        self.accel_prefix = None
+        self._removing = deque()
+        self._worker = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import db
+
+        self.root = app.config['UPLOADED_FILES_DEST']
+        self.accel_prefix = app.config.get('STATIC_ACCEL_REDIRECT')
+        app.teardown_appcontext(self._teardown)
+        if not event.contains(db.session, 'after_commit', self._after_commit):
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_soft_rollback', self._after_rollback)
+
+    def path(self, name):
+        return path.join(self.root, name)
+
+    def save(self, file, name):
+        """file 为werkzeug的FileStorage，name 为相对UPLOADED_FILES_DEST的路径"""
+
+        dst = self.path(name)
+        tmp = self._write(file, dst)
+        self._pending().append(('save', tmp, dst))
+
+    def save_blob(self, file, name, blob_dir):
+        """
+        边写边算sha256，内容存为 blob_dir/<sha256>.<后缀>（已有则不再重复存），
+        name 为指向该blob的硬链接，原有按文件名的访问方式不变。返回blob名
+        """
+
+        dst = self.path(name)
+        digest = sha256()
+        tmp = self._write(file, dst, digest)
+        blob = f'{digest.hexdigest()}.{name.rsplit(".", 1)[1]}'
+        self._pending().append(('link', tmp, dst, self.path(path.join(blob_dir, blob))))
+        return blob
+
+    def _write(self, file, dst, digest=None):
+        tmp = f'{dst}.{uuid4().hex[:8]}.tmp'
+        with open(tmp, 'wb') as f:
+            while True:
+                chunk = file.stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                sleep(0)  # 每块之间让出，其他协程得以运行
+            f.flush()
+            tpool.execute(fsync, f.fileno())
+        return tmp
+
+    @staticmethod
+    def link_blob(tmp, dst, blob):
+        """已有相同内容的blob则丢弃tmp，否则tmp成为新blob；dst 再硬链接到blob"""
+
+        try:
+            link(blob, dst)
+        except FileNotFoundError:
+            makedirs(path.dirname(blob), exist_ok=True)
+            replace(tmp, blob)
+            link(blob, dst)
+        else:
+            remove(tmp)
+
+    def dedup(self, name, blob_dir):
+        """
+        维护用：把已存在的文件并入blob存储，内容相同的改为指向同一blob的硬链接
+        返回blob名，文件不存在则返回None
+        """
+
+        dst = self.path(name)
+        if not path.isfile(dst):
+            return None
+
+        digest = sha256()
+        with open(dst, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                digest.update(chunk)
+        blob = f'{digest.hexdigest()}.{name.rsplit(".", 1)[1]}'
+        blob_path = self.path(path.join(blob_dir, blob))
+
+        if not path.exists(blob_path):
+            makedirs(path.dirname(blob_path), exist_ok=True)
+            link(dst, blob_path)
+        elif not path.samefile(dst, blob_path):
+            tmp = f'{dst}.{uuid4().hex[:8]}.tmp'
+            link(blob_path, tmp)
+            replace(tmp, dst)  # 原子地换成硬链接，释放重复的那份
+        return blob
+
+    def send(self, name, etag=None, mimetype=None, compress=False, max_age=None):
+        """
+        流式发送已存文件，支持 If-None-Match 304 与 Range 分段；服务器提供 wsgi.file_wrapper 时零拷贝
+        etag 为强校验值（如内容哈希），不给则由 inode/mtime/大小 生成，文件被替换即变
+        compress 为真且客户端接受gzip时边读边压缩（此时不支持Range）
+        max_age 给出时为可长期缓存的不可变文件，否则客户端每次都需以ETag验证
+        配置了 STATIC_ACCEL_REDIRECT 时只返回 X-Accel-Redirect 头，由nginx读文件并处理缓存验证与Range
+        """
+
+        p = self.path(name)
+        if not path.isfile(p):
+            abort(404)
+        st = stat(p)
+
+        if self.accel_prefix:
+            rv = Response(mimetype=mimetype or guess_type(p)[0] or 'application/octet-stream')
+            rv.headers['X-Accel-Redirect'] = self.accel_prefix + name
+            return self._cache_control(rv, max_age)
+
+        if etag is None:
+            etag = f'{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}'
+
+        if compress and 'Range' not in request.headers and request.accept_encodings['gzip']:
+            rv = Response(self._gzip(p), mimetype=mimetype, direct_passthrough=True)
+            rv.headers['Content-Encoding'] = 'gzip'
+            rv.set_etag(f'{etag}-gz')
+            rv.vary.add('Accept-Encoding')
+            return self._cache_control(rv, max_age).make_conditional(request)
+
+        rv = send_file(p, mimetype=mimetype, add_etags=False)
+        rv.set_etag(etag)
+        if compress:
+            rv.vary.add('Accept-Encoding')
+        rv = self._cache_control(rv, max_age)
+        return rv.make_conditional(request, accept_ranges=True, complete_length=st.st_size)
+
+    @staticmethod
+    def _cache_control(rv, max_age):
+        # 覆盖send_file默认的 max-age
+        if max_age is None:
+            rv.headers['Cache-Control'] = 'no-cache'
+        else:
+            rv.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+        return rv
+
+    def _gzip(self, p):
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 即带gzip头
+        with open(p, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                data = z.compress(chunk)
+                if data:
+                    yield data
+        yield z.flush()
+
+    def remove(self, name):
+        self._pending().append(('remove', self.path(name)))
+
+    def after_commit(self, fn, *args):
+        """数据库提交、此前保存的文件都就位后，在后台协程中执行 fn(*args)；回滚则不执行"""
+        self._pending().append(('call', fn, args))
+
+    @staticmethod
+    def _pending():
+        if 'storage_pending' not in g:
+            g.storage_pending = []
+        return g.storage_pending
+
+    @staticmethod
+    def _pop_pending():
+        if not has_app_context():
+            return []
+        return g.pop('storage_pending', None) or []
+
+    def _after_commit(self, session):
+        for op in self._pop_pending():
+            if op[0] == 'save':
+                replace(op[1], op[2])
+            elif op[0] == 'link':
+                self.link_blob(*op[1:])
+            elif op[0] == 'call':
+                spawn(op[1], *op[2])
+            else:
+                self._removing.append((op[1], 0))
+
+        if self._removing and self._worker is None:
+            self._worker = spawn(self._run)
+
+    def _after_rollback(self, session, previous_transaction):
+        for op in self._pop_pending():
+            if op[0] in ('save', 'link'):
+                self._unlink(op[1])
+
+    def _teardown(self, exc):
+        # 请求结束仍未提交的，按回滚处理
+        self._after_rollback(None, None)
+
+    @staticmethod
+    def _unlink(p):
+        if path.isfile(p):
+            remove(p)
+
+    def _run(self):
+        while self._removing:
+            p, tries = self._removing.popleft()
+            try:
+                self._unlink(p)
+            except OSError:
+                if tries + 1 < self.retries:
+                    self._removing.append((p, tries + 1))
+                    sleep(self.retry_interval)
+        self._worker = None
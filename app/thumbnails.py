@@ -0,0 +1,66 @@
+from eventlet import tpool
+from os import replace, path
+from uuid import uuid4
+
+from config import AVATAR_SIZES
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 未安装Pillow时不生成缩略图，一律返回原图
+    Image = None
+
+
+class Thumbnails(object):
+    """
+    头像缩略图：上传提交后在后台解码一次，裁成正方形按 AVATAR_SIZES 各存一份 img/<名>_<尺寸>.<后缀>
+    解码与缩放是CPU密集的，放到线程池中执行以免阻塞其他协程
+    """
+
+    def __init__(self, storage, sizes=AVATAR_SIZES):
+        self.storage = storage
+        self.sizes = sorted(sizes, reverse=True)
+
+    @staticmethod
+    def name(avatar, size):
+        stem, ext = avatar.rsplit('.', 1)
+        return f'{stem}_{size}.{ext}'
+
+    def names(self, avatar):
+        return [self.name(avatar, size) for size in self.sizes]
+
+    def lookup(self, avatar, size):
+        """返回该尺寸缩略图的文件名，尚未生成、尺寸不支持或文件名无后缀(不会有缩略图)时返回原图"""
+
+        if size in self.sizes and '.' in avatar:
+            thumb = self.name(avatar, size)
+            if path.isfile(self.storage.path(f'img/{thumb}')):
+                return thumb
+        return avatar
+
+    def render_later(self, avatar):
+        """在数据库提交、原图就位后生成"""
+        if Image is not None:
+            self.storage.after_commit(self.render, avatar)
+
+    def render(self, avatar):
+        try:
+            tpool.execute(self._render, avatar)
+        except OSError:
+            pass  # 无法解码的图片不生成缩略图，仍返回原图
+
+    def _render(self, avatar):
+        src = self.storage.path(f'img/{avatar}')
+        fmt = 'PNG' if avatar.rsplit('.', 1)[1].lower() == 'png' else 'JPEG'
+        with Image.open(src) as img:
+            img.draft('RGB', (self.sizes[0], self.sizes[0]))  # jpeg可直接按比例解码，省去大半工作
+            img = ImageOps.exif_transpose(img)
+            if fmt == 'JPEG':
+                img = img.convert('RGB')
+
+            for size in self.sizes:
+                # 由大到小依次缩放，每次都基于上一份结果
+                img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+                dst = self.storage.path(f'img/{self.name(avatar, size)}')
+                tmp = f'{dst}.{uuid4().hex[:8]}.tmp'
+                img.save(tmp, format=fmt)
+                replace(tmp, dst)
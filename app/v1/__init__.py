@@ -22,4 +22,4 @@ api = Api(v1)
 
 
 from . import users, teams, errors
-from . import schedules, attendances, tasks, questionnaires, logs
+from . import schedules, attendances, tasks, questionnaires, logs, messages
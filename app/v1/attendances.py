@@ -1,14 +1,19 @@
 from flask import g
-from flask_restful import Resource, reqparse, inputs, marshal, fields
+from flask_restful import Resource, inputs, fields
 
 from . import api
-from ..models import Attendance, Team
+from ..models import Attendance, AttendanceDailyStat, Team
 from .. import db
 from .decorators import auth
 from .exceptions import ForbiddenError
+from .membership import member_or_403
+from .parsers import RequestParser
+from .serializers import marshal
 
-from datetime import datetime
-from sqlalchemy import extract
+from calendar import monthrange
+from datetime import datetime, date as Date
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.mysql import insert
 
 
 attendance_fields = {
@@ -18,41 +23,59 @@ attendance_fields = {
     'punctual': fields.Boolean,
     'tid': fields.Integer(attribute='team_id'),
 }
+stat_fields = {
+    'date': fields.DateTime(dt_format='iso8601'),
+    'present': fields.Integer,
+    'punctual': fields.Integer,
+}
+
+attendances_get_parser = RequestParser()
+attendances_get_parser.add_argument('date', type=inputs.date, required=True, location='args')
+attendances_get_parser.add_argument('spec', type=inputs.boolean, default=False, location='args')
+# 是否返回详细信息(仅对队长有效)
+attendances_get_parser.add_argument('self', type=inputs.boolean, default=False, location='args')
+# 是否返回自己的详细信息(覆盖spec)
+
+stats_get_parser = RequestParser()
+stats_get_parser.add_argument('year', type=inputs.int_range(1, 9999), required=True, location='args')
+stats_get_parser.add_argument('month', type=inputs.int_range(1, 12), required=True, location='args')
+
+
+def count_attendance(a):
+    """在打卡的同一事务内累加当天汇总，ON DUPLICATE KEY UPDATE 保证并发下计数准确"""
+    stats = AttendanceDailyStat.__table__
+    stmt = insert(stats).values(team_id=a.team_id, date=a.date, present=1, punctual=int(a.punctual))
+    stmt = stmt.on_duplicate_key_update(present=stats.c.present + 1,
+                                        punctual=stats.c.punctual + int(a.punctual))
+    db.session.execute(stmt)
 
 
 class AttendanceListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def post(self, tid):
         """团队成员在规定时间内打卡"""
 
-        team = Team.query.get_or_404(tid)
         user = g.current_user
+        team = member_or_403(Team, tid, user.id, '仅本团队成员可打卡')
         d = datetime.now()
 
-        if not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('仅本团队成员可打卡')
-
-        if team.attendances.filter(
-                Attendance.uid == user.id,
-                extract('year', Attendance.datetime) == d.year,
-                extract('month', Attendance.datetime) == d.month,
-                extract('day', Attendance.datetime) == d.day,
-        ).first():
-            raise ForbiddenError('不可重复打卡')
-
         if not (team.check_s <= d.time()):
             raise ForbiddenError('未到打卡时间')
 
-        a = Attendance(uid=user.id, datetime=d)
+        a = Attendance(uid=user.id, datetime=d, date=d.date())
         a.punctual = d.time() <= team.check_e
         team.attendances.append(a)
 
-        db.session.add_all([a, team])
-        db.session.commit()
+        try:
+            db.session.add_all([a, team])
+            db.session.flush()
+            count_attendance(a)
+            db.session.commit()
+        except IntegrityError:
+            # (team_id, date, uid) 唯一约束，并发的重复打卡也只会有一条成功
+            db.session.rollback()
+            raise ForbiddenError('不可重复打卡')
 
         response = {'code': 0, 'message': '', 'data': marshal(a, attendance_fields)}
         return response, 201
@@ -63,24 +86,13 @@ class AttendanceListAPI(Resource):
         :param tid: 查询的团队id
         :return: 返回某一天的打卡数据
         """
-        self.reqparser.add_argument('date', type=inputs.date, required=True, location='args')
-        self.reqparser.add_argument('spec', type=inputs.boolean, default=False, location='args')
-        # 是否返回详细信息(仅对队长有效)
-        self.reqparser.add_argument('self', type=inputs.boolean, default=False, location='args')
-        # 是否返回自己的详细信息(覆盖spec)
-        args = self.reqparser.parse_args(strict=True)
-
-        team = Team.query.get_or_404(tid)
-        user = g.current_user
-
-        if not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可获取其他团队的打卡记录')
+        args = attendances_get_parser.parse_args(strict=True)
 
-        date_tuple = args.date.timetuple()[:3]
-        dt_s = datetime(*date_tuple)  # 一天的开端
-        dt_e = datetime.max.replace(*date_tuple)  # 一天的结尾
+        user = g.current_user
+        team = member_or_403(Team, tid, user.id, '不可获取其他团队的打卡记录')
 
-        query = team.attendances.filter(Attendance.datetime.between(dt_s, dt_e))
+        day = args.date.date()
+        query = team.attendances.filter(Attendance.date == day)
 
         if args.self:
             # 用户查看自己的打卡情况
@@ -93,11 +105,35 @@ class AttendanceListAPI(Resource):
 
         else:
             # 一般成员查看团队简要信息: 已打卡与准时的人数
-            punctual = query.filter_by(punctual=True).count()
-            data = {'present': query.count(), 'punctual': punctual}
+            s = AttendanceDailyStat.query.get((tid, day))
+            data = {'present': s.present, 'punctual': s.punctual} if s else {'present': 0, 'punctual': 0}
 
         response = {'code': 0, 'message': '', 'data': data}
         return response, 200
 
 
+class AttendanceStatAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self, tid):
+        """团队成员获取某月每天的打卡汇总(供日历视图)，没有打卡的日期不返回"""
+
+        args = stats_get_parser.parse_args(strict=True)
+
+        team = member_or_403(Team, tid, g.current_user.id, '不可获取其他团队的打卡记录')
+
+        y, m = args.year, args.month
+        start = Date(y, m, 1)
+        end = Date(y, m, monthrange(y, m)[1])  # 当月最后一天，9999年12月也不越界
+
+        stats = team.attendance_stats.filter(
+            AttendanceDailyStat.date >= start,
+            AttendanceDailyStat.date <= end
+        ).order_by(AttendanceDailyStat.date)
+
+        response = {'code': 0, 'message': '', 'data': marshal(stats.all(), stat_fields)}
+        return response, 200
+
+
 api.add_resource(AttendanceListAPI, '/teams/<int:tid>/attendances')
+api.add_resource(AttendanceStatAPI, '/teams/<int:tid>/attendances/stats')
@@ -0,0 +1,25 @@
+from flask import request, Response
+from werkzeug.http import quote_etag
+from zlib import crc32
+
+# 团队数据的条件GET：ETag 由团队版本号(Team.version)与请求路径生成
+# 客户端轮询时带上 If-None-Match，团队无变更则只需查一次版本号即返回304
+
+
+def team_etag(team_id, version):
+    """同一URL在团队无变更期间ETag不变，路径(含查询串)不同则不同"""
+    return f'{team_id}-{version}-{crc32(request.full_path.encode()):08x}'
+
+
+def not_modified(etag):
+    """If-None-Match 命中时返回304响应，否则返回None"""
+    if not request.if_none_match.contains_weak(etag):  # 经nginx gzip后ETag会变为弱校验值
+        return None
+    rv = Response(status=304)
+    rv.headers.update(etag_headers(etag))
+    return rv
+
+
+def etag_headers(etag):
+    """随200响应返回；no-cache 使客户端每次都带ETag来确认"""
+    return {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
@@ -1,30 +1,110 @@
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
 from ..models import User
+from .. import db
 from flask import g
+from sqlalchemy import or_
+
+from collections import OrderedDict
+from time import time
+from config import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
 
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
 auth = MultiAuth(basic_auth, token_auth)
 
 
+class UserIdentity(object):
+    """
+    g.current_user 的轻量身份，多数接口只需 id/username
+    需要修改用户或完整信息时再通过 .user 加载 User 对象（同一请求只查一次）
+    """
+
+    __slots__ = ('id', 'username', '_user')
+
+    def __init__(self, uid, username, user=None):
+        self.id = uid
+        self.username = username
+        self._user = user
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user)
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return self._user
+
+
+class TokenCache(object):
+    """已验证令牌 -> (uid, username) 的LRU缓存，条目过期时间取 TTL 与令牌过期时间的较小者"""
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, token):
+        item = self._data.get(token)
+        if item is None:
+            return None
+
+        identity, expire = item
+        if expire <= time():
+            del self._data[token]
+            return None
+
+        self._data.move_to_end(token)
+        return identity
+
+    def set(self, token, identity, token_exp):
+        self._data[token] = (identity, min(time() + self.ttl, token_exp))
+        self._data.move_to_end(token)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard_user(self, uid):
+        """用户信息变更后使其所有缓存令牌失效"""
+        for token in [k for k, v in self._data.items() if v[0][0] == uid]:
+            del self._data[token]
+
+    def clear(self):
+        self._data.clear()
+
+
+token_cache = TokenCache()
+
+
 @basic_auth.verify_password
 def verify_password(username, password):
-    """支持用户名/密码登录"""
-    user = User.query.filter_by(username=username).first()
-    if not user:
-        user = User.query.filter_by(email=username).first()
+    """支持用户名/邮箱+密码登录，用户名不含@，不会与邮箱混淆"""
+    user = User.query.filter(or_(User.username == username, User.email == username)).first()
 
     if not user or not user.verify_password(password):
         # 至少获取令牌是需要验证密码
         return False
-    g.current_user = user
+    if db.session.is_modified(user):
+        db.session.commit()  # 旧哈希已升级
+    g.current_user = UserIdentity.from_user(user)
     return True
 
 
 @token_auth.verify_token
 def verify_token(token):
-    user = User.verify_auth_token(token)
+    cached = token_cache.get(token)
+    if cached is not None:
+        g.current_user = UserIdentity(*cached)
+        return True
+
+    data, exp = User.load_auth_token(token)
+    if data is None:
+        return False
+
+    user = User.query.get(data['uid'])
     if not user:
         return False
-    g.current_user = user
+
+    token_cache.set(token, (user.id, user.username), exp)
+    g.current_user = UserIdentity.from_user(user)
     return True
@@ -1,11 +1,12 @@
 from flask import g
-from flask_restful import Resource, reqparse, marshal, fields
+from flask_restful import Resource, fields
 
 from . import api
 from ..models import Team, Log
-from .. import db
 from .decorators import auth
-from .exceptions import ForbiddenError
+from .membership import member_or_403
+from .pagination import paginate, page_parser
+from .serializers import marshal
 
 from config import LOG_PER_PAGE
 
@@ -15,29 +16,18 @@ log_fields = {
     'desc': fields.String,
     'datetime': fields.DateTime(dt_format='iso8601'),
 }
-reqparser = reqparse.RequestParser()
-reqparser.add_argument('page', type=int, default=1, location='args')
 
 
 class LogListAPI(Resource):
     decorators = [auth.login_required]
 
     def get(self, tid):
-        args = reqparser.parse_args(strict=True)
+        args = page_parser.parse_args(strict=True)
 
-        team = Team.query.get_or_404(tid)
-        user = g.current_user
+        team = member_or_403(Team, tid, g.current_user.id, '不可查看其他团队的日志')
 
-        if not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的日志')
-
-        pagination = team.logs.order_by(Log.datetime.desc()).paginate(
-            page=args.page,
-            per_page=LOG_PER_PAGE
-        )
-
-        data = {'pages': pagination.pages, 'total': pagination.total,
-                'logs': marshal(pagination.items, log_fields)}
+        items, data = paginate(team.logs, Log, args, LOG_PER_PAGE)
+        data['logs'] = marshal(items, log_fields)
 
         response = {'code': 0, 'message': '', 'data': data}
         return response, 200
@@ -0,0 +1,64 @@
+from flask import abort
+from sqlalchemy.orm import contains_eager
+
+from .. import db
+from ..models import Team, member_exists
+from .exceptions import ForbiddenError
+
+# 团队资源的鉴权：对象本身与"当前用户是否为其所属团队成员"在同一条SQL中取出
+# 取代 get_or_404 之后再单独 team.users.filter_by(id=...).exists() 的两次查询
+
+
+def query_with_membership(model, uid):
+    """查询 model 并附带 uid 是否为其所属团队(Team本身或 model.team_id)的成员"""
+    team_id = Team.id if model is Team else model.team_id
+    return db.session.query(model, member_exists(team_id, uid).label('joined'))
+
+
+def get_or_404(model, ident, uid):
+    """返回 (对象, 是否成员)，对象不存在则404"""
+    row = query_with_membership(model, uid).filter(model.id == ident).first()
+    if row is None:
+        abort(404)
+    return row
+
+
+def member_or_403(model, ident, uid, message=None):
+    """仅当uid为所属团队成员时返回对象，否则403"""
+    obj, joined = get_or_404(model, ident, uid)
+    if not joined:
+        raise ForbiddenError(message)
+    return obj
+
+
+def versioned_or_403(model, ident, uid, message=None):
+    """同 member_or_403，另返回所属团队的版本号，仍是一条SQL"""
+    query = query_with_membership(model, uid).add_columns(Team.version)
+    if model is not Team:
+        query = query.join(Team, Team.id == model.team_id)
+
+    row = query.filter(model.id == ident).first()
+    if row is None:
+        abort(404)
+    obj, joined, version = row
+    if not joined:
+        raise ForbiddenError(message)
+    return obj, version
+
+
+def leader_or_403(model, ident, uid, message=None):
+    """
+    仅当uid为所属团队队长时返回对象，否则403(队长必为成员)，一条SQL
+    团队经 contains_eager 填入 obj.team，之后访问不再查询
+    """
+    if model is Team:
+        obj = team = Team.query.get(ident)
+    else:
+        obj = model.query.join(model.team).options(contains_eager(model.team)).filter(model.id == ident).first()
+        team = obj and obj.team
+
+    if obj is None:
+        abort(404)
+    if team.leader != uid:
+        raise ForbiddenError(message)
+    return obj
@@ -0,0 +1,63 @@
+from flask import g
+from flask_restful import Resource, fields
+
+from . import api
+from ..models import Team, Message
+from .. import presence
+from .decorators import auth
+from .membership import member_or_403
+from .pagination import paginate
+from .parsers import RequestParser
+from .serializers import marshal
+
+from config import MSG_PER_PAGE
+from json import loads as json_loads
+
+
+class ContentItem(fields.Raw):
+    def format(self, value):
+        return json_loads(value)
+
+
+message_fields = {
+    'id': fields.Integer,
+    'uid': fields.Integer,
+    'content': ContentItem,
+    # 客户端当初发送的json
+    'datetime': fields.DateTime(dt_format='iso8601'),
+}
+messages_get_parser = RequestParser()
+messages_get_parser.add_argument('cursor', type=str, default='', location='args')
+# 只支持键集分页，首页不传或传空字符串
+
+
+class MessageListAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self, tid):
+        """团队成员获取聊天记录，由新到旧"""
+
+        args = messages_get_parser.parse_args(strict=True)
+        team = member_or_403(Team, tid, g.current_user.id, '不可查看其他团队的聊天记录')
+
+        items, data = paginate(team.messages, Message, args, MSG_PER_PAGE)
+        data['messages'] = marshal(items, message_fields)
+
+        response = {'code': 0, 'message': '', 'data': data}
+        return response, 200
+
+
+class OnlineAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self, tid):
+        """团队成员获取当前在聊天室内在线的成员id"""
+
+        member_or_403(Team, tid, g.current_user.id, '不可查看其他团队的在线成员')
+
+        response = {'code': 0, 'message': '', 'data': {'uids': presence.online(tid)}}
+        return response, 200
+
+
+api.add_resource(MessageListAPI, '/teams/<int:tid>/messages')
+api.add_resource(OnlineAPI, '/teams/<int:tid>/online')
@@ -0,0 +1,55 @@
+from sqlalchemy import or_, and_
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from .exceptions import BadRequestError
+from .parsers import RequestParser
+
+# 列表接口的分页：默认沿用 page 参数的 LIMIT/OFFSET 分页
+# 带上 cursor 参数(首页传空字符串)则改用 (datetime, id) 键集分页，不再 COUNT，也不随页数变慢
+# datetime 可为NULL，MySQL倒序时NULL排在最后，游标中以空串表示
+
+page_parser = RequestParser()
+page_parser.add_argument('page', type=int, default=1, location='args')
+page_parser.add_argument('cursor', type=str, location='args')
+# 列表接口共用，还需其他参数的先 copy() 再添加
+
+
+def encode_cursor(obj):
+    dt = obj.datetime.isoformat() if obj.datetime is not None else ''
+    raw = f'{dt}|{obj.id}'
+    return urlsafe_b64encode(raw.encode()).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        dt, ident = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return (datetime.fromisoformat(dt) if dt else None), int(ident)
+    except Exception:
+        raise BadRequestError('cursor无效')
+
+
+def paginate(query, model, args, per_page):
+    """
+    按 model.datetime, model.id 倒序分页，利用 (team_id, datetime, id) 联合索引
+    :param args: 含 page 与 cursor 的请求参数
+    :return: (本页对象列表, 分页信息dict)
+    """
+
+    query = query.order_by(model.datetime.desc(), model.id.desc())
+
+    if args.get('cursor') is None:
+        pagination = query.paginate(page=args.page, per_page=per_page)
+        return pagination.items, {'pages': pagination.pages, 'total': pagination.total}
+
+    if args.cursor:
+        dt, ident = decode_cursor(args.cursor)
+        if dt is None:
+            query = query.filter(model.datetime.is_(None), model.id < ident)
+        else:
+            query = query.filter(or_(model.datetime < dt, and_(model.datetime == dt, model.id < ident),
+                                     model.datetime.is_(None)))
+
+    items = query.limit(per_page + 1).all()
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return items[:per_page], {'next_cursor': next_cursor}
@@ -0,0 +1,28 @@
+from flask import request
+from flask_restful import reqparse
+
+
+class _Sources(object):
+    """request 的 json/args/form 等各只取一次，同一次解析的所有参数共用"""
+
+    def __init__(self, req):
+        self._req = req
+
+    def __getattr__(self, name):
+        value = getattr(self._req, name, None)
+        if callable(value):
+            value = value()
+        self.__dict__[name] = value
+        return value
+
+
+class RequestParser(reqparse.RequestParser):
+    """
+    在模块加载时建好、所有请求共用的参数解析器，参数与类型校验只编译一次
+    解析时不再让每个参数都经 LocalProxy 重新读取请求体/查询串
+    """
+
+    def parse_args(self, req=None, strict=False, http_error_code=400):
+        if req is None:
+            req = _Sources(request._get_current_object())
+        return super().parse_args(req, strict, http_error_code)
@@ -1,48 +1,27 @@
-from flask import g
-from flask_restful import Resource, reqparse, inputs, marshal, fields
-from sqlalchemy.exc import IntegrityError
+from flask import g, Response, stream_with_context
+from flask_restful import Resource, inputs, fields
+from sqlalchemy import tuple_
 
 from . import api
 from ..models import Team, Questionnaire, QQuestion, QOption, Log
-from ..models import QRecord, QAnswer
-from .. import db
+from ..models import QRecord, QAnswer, QTally
+from .. import db, compact_dumps, response_cache
 from .decorators import auth
 from .exceptions import ForbiddenError, BadRequestError
+from .membership import member_or_403, versioned_or_403, leader_or_403
+from .pagination import paginate, page_parser
+from .parsers import RequestParser
+from .serializers import marshal
+from .conditional import team_etag, not_modified, etag_headers
 
 from config import QUESTIONNAIRE_PER_PAGE
-import re
+import csv
+from io import StringIO
+from itertools import groupby
 from datetime import datetime
 from json import loads as json_loads
 
 
-class OptionItem(fields.Raw):
-    def format(self, value):
-        return marshal(value, option_fields)
-
-
-class IsFilled(fields.Raw):
-    def output(self, key, obj):
-        q = getattr(obj, self.attribute).filter_by(username=g.current_user.username)
-        return db.session.query(q.exists()).scalar()
-
-
-class AnswerItem(fields.Raw):
-    def format(self, value):
-        # value.ans = (json_loads, str,)[value.type == 3](value.ans)
-        # 恢复单选多选答案的格式
-        # 不可行：sqlalchemy.exc.InvalidRequestError: This Session's transaction has been rolled back...
-        return marshal(value, answer_fields)
-
-
-class AnsItem(fields.Raw):
-    def output(self, key, obj):
-        ans = getattr(obj, key)
-
-        if getattr(obj, 'type') in (1, 2,):
-            ans = json_loads(ans)
-        return ans
-
-
 option_fields = {
     'oid': fields.Integer,
     'desc': fields.String,
@@ -51,7 +30,11 @@ question_fields = {
     'qid': fields.Integer,
     'desc': fields.String,
     'type': fields.Integer,
-    'options': fields.List(OptionItem),
+    'options': fields.List(fields.Nested(option_fields)),
+}
+tally_fields = {
+    'oid': fields.Integer,
+    'count': fields.Integer,
 }
 questionnaire_fields = {
     'id': fields.Integer,
@@ -59,38 +42,137 @@ questionnaire_fields = {
     'desc': fields.String,
     'datetime': fields.DateTime(dt_format='iso8601'),
     'deadline': fields.DateTime(dt_format='iso8601'),
-    'filled': IsFilled(attribute='records'),
-    # 仅表示发出get的该用户自身是否填写了此问卷
+    'filled': fields.Boolean(default=False),
+    # 仅表示发出get的该用户自身是否填写了此问卷，由 mark_filled 批量标记
 }
 
-answer_fields = {
-    'qid': fields.Integer,
-    'type': fields.Integer,
-    'ans': AnsItem,
-    # 已在AnswerItem里处理过格式
-}
-record_fields = {
-    'username': fields.String,
-    'datetime': fields.DateTime(dt_format='iso8601'),
-    'answers': fields.List(AnswerItem),
+questionnaires_post_parser = RequestParser()
+questionnaires_post_parser.add_argument('title', type=str, required=True, location='json')
+questionnaires_post_parser.add_argument('desc', type=str, location='json')
+questionnaires_post_parser.add_argument('deadline', type=inputs.datetime_from_iso8601, required=True, location='json')
+questionnaires_post_parser.add_argument('questions', type=list, required=True, location='json')
+# questions 应是题目列表，每个题目又含选项列表
+
+questionnaire_post_parser = RequestParser()
+questionnaire_post_parser.add_argument('answers', type=list, required=True, location='json')
+# answers 应是答案列表，里面每个对象包含题号qid、类型type、内容ans
+
+records_get_parser = RequestParser()
+records_get_parser.add_argument('format', type=str, choices=('json', 'csv'), default='json', location='args')
+
+
+def mark_filled(questionnaires, username):
+    """一次 IN 查询得出本页各问卷该用户是否已填写，结果写到 filled 属性供 marshal 使用"""
+    ids = [q.id for q in questionnaires]
+    filled = set()
+    if ids:
+        rows = db.session.query(QRecord.questionnaire_id).filter(
+            QRecord.questionnaire_id.in_(ids),
+            QRecord.username == username
+        )
+        filled = {r.questionnaire_id for r in rows}
+
+    for q in questionnaires:
+        q.filled = q.id in filled
+    return questionnaires
+
+
+def check_item(item, required, optional=None):
+    """
+    手动验证多层嵌套的json参数(题目/选项/答案)，取代插入后再解析 TypeError/IntegrityError
+    required/optional 为 {字段名: 类型}，返回只含合法字段的新dict
+    """
+
+    optional = optional or {}
+    if not isinstance(item, dict):
+        raise BadRequestError('参数格式错误')
+
+    extra = item.keys() - required.keys() - optional.keys()
+    if extra:
+        raise BadRequestError('多余参数: ' + extra.pop())
+
+    for k, t in {**optional, **required}.items():
+        v = item.get(k)
+        if v is None:
+            if k in required:
+                raise BadRequestError('缺失参数: ' + k)
+        elif not isinstance(v, t) or isinstance(v, bool):
+            raise BadRequestError('参数类型错误: ' + k)
+    return {k: v for k, v in item.items() if v is not None}
+
+
+def check_questions(questions):
+    """验证题目列表，返回 [(题目dict, 选项list)]；题号、同一题内的选项序号不可重复"""
+
+    checked = []
+    qids = set()
+    for q in questions:
+        q = check_item(q, {'qid': int, 'desc': str, 'type': int}, {'options': list})
+        ops = [check_item(op, {'oid': int, 'desc': str}) for op in q.pop('options', None) or []]
+        # 简答题ops==[]
+
+        if q['type'] not in (1, 2, 3,):
+            raise BadRequestError('题目类型错误: ' + str(q['qid']))
+        if q['qid'] in qids or len({op['oid'] for op in ops}) != len(ops):
+            raise BadRequestError('题号或选项序号重复: ' + str(q['qid']))
+        qids.add(q['qid'])
+        checked.append((q, ops))
+    return checked
+
+
+ANSWER_CHECKS = {
+    1: lambda ans: isinstance(ans, int) and not isinstance(ans, bool),
+    2: lambda ans: isinstance(ans, list) and all(isinstance(oid, int) and not isinstance(oid, bool) for oid in ans),
+    3: lambda ans: isinstance(ans, str),
 }
+# 单选为选项序号，多选为选项序号列表，简答为字符串
+
+
+def check_answers(answers, types):
+    """验证答案列表，types 为该问卷的 {题号: 题目类型}；题号须属于该问卷且不重复，答案类型须与题目一致"""
+
+    checked = []
+    qids = set()
+    for a in answers:
+        a = check_item(a, {'qid': int, 'type': int, 'ans': (int, str, list)})
+        qid = a['qid']
+        if qid not in types or qid in qids:
+            raise BadRequestError('题号不存在或重复: ' + str(qid))
+        if a['type'] != types[qid] or not ANSWER_CHECKS[a['type']](a['ans']):
+            raise BadRequestError('答案与题目类型不符: ' + str(qid))
+        qids.add(qid)
+        checked.append(a)
+    return checked
+
+
+def count_choices(qid, answers):
+    """
+    将本次提交中选择题选中的 (题号, 选项) 在 q_tallies 中各加一，一条UPDATE完成
+    只会命中发布时建好的行，故不存在的题号/选项会被忽略
+    """
+
+    pairs = set()
+    for answer in answers:
+        if answer.get('type') not in (1, 2,):
+            continue
+        ans = answer.get('ans')
+        ans = ans if isinstance(ans, list) else [ans]
+        pairs.update((answer.get('qid'), oid) for oid in ans if isinstance(oid, int))
+
+    if pairs:
+        QTally.query.filter(
+            QTally.questionnaire_id == qid,
+            tuple_(QTally.qid, QTally.oid).in_(pairs)
+        ).update({QTally.count: QTally.count + 1}, synchronize_session=False)
 
 
 class QuestionnaireListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def post(self, tid):
         """团队队长发布团队调查问卷"""
 
-        self.reqparser.add_argument('title', type=str, required=True, location='json')
-        self.reqparser.add_argument('desc', type=str, location='json')
-        self.reqparser.add_argument('deadline', type=inputs.datetime_from_iso8601, required=True, location='json')
-        self.reqparser.add_argument('questions', type=list, required=True, location='json')
-        # questions 应是题目列表，每个题目又含选项列表
-        args = self.reqparser.parse_args(strict=True)
+        args = questionnaires_post_parser.parse_args(strict=True)
 
         team = Team.query.get_or_404(tid)
         user = g.current_user
@@ -98,39 +180,31 @@ class QuestionnaireListAPI(Resource):
         if team.leader != user.id:
             raise ForbiddenError('仅本团队队长可发布调查问卷')
 
-        questions = args.pop('questions')
+        questions = check_questions(args.pop('questions'))
+        # 先验证全部参数，之后题目、选项、统计行各一条批量INSERT，与日志同在一个事务中
         questionnaire = Questionnaire(**args)
         team.questionnaires.append(questionnaire)
-
-        try:
-            # 手动验证多层嵌套的json参数，实际上实名问卷也不怕乱填，都有记录
-            for q in questions:
-                ops = q.pop('options') or []
-                qq = QQuestion(**q)
-
-                for op in ops:
-                    # 简答题ops==[]，不会执行该语句块
-                    qo = QOption(**op)
-                    qq.options.append(qo)
-
-                questionnaire.questions.append(qq)
-                # 会自动根据外键分析，故题目与选项不需 session.add
-        except TypeError as e:
-            # ee = "多余参数: " + str(e).split(' is ', 1)[0][1:-1]
-            ee = "多余参数: " + re.findall(r"'(.*?)' is", str(e))[0]
-            raise BadRequestError(ee)
-
-        try:
-            db.session.add(questionnaire)
-            db.session.commit()
-        except IntegrityError as e:
-            ee = "缺失参数: " + re.findall(r"Column \\\'(\w+)\\\'", repr(e))[0]
-            raise BadRequestError(ee)
-
-        log = Log(uid=g.current_user.id, desc=f'创建了问卷: {questionnaire.title}')
+        log = Log(uid=user.id, desc=f'创建了问卷: {questionnaire.title}')
         team.logs.append(log)
-        db.session.add(log)
-        db.session.commit()  # 上方为了验证参数要跟这里分开
+        db.session.add_all((questionnaire, log,))
+        db.session.flush()
+
+        q_id = questionnaire.id
+        if questions:
+            db.session.execute(QQuestion.__table__.insert(),
+                               [dict(q, questionnaire_id=q_id) for q, _ in questions])
+
+        ids = dict(db.session.query(QQuestion.qid, QQuestion.id).filter(QQuestion.questionnaire_id == q_id))
+        # executemany 拿不到各行自增id，按题号查回
+        options = [dict(op, question_id=ids[q['qid']]) for q, ops in questions for op in ops]
+        tallies = [{'questionnaire_id': q_id, 'qid': q['qid'], 'oid': op['oid'], 'count': 0}
+                   for q, ops in questions if q['type'] in (1, 2,) for op in ops]
+
+        if options:
+            db.session.execute(QOption.__table__.insert(), options)
+        if tallies:
+            db.session.execute(QTally.__table__.insert(), tallies)
+        db.session.commit()
 
         response = {'code': 0, 'message': '', 'data': marshal(questionnaire, questionnaire_fields)}
         return response, 201
@@ -138,22 +212,12 @@ class QuestionnaireListAPI(Resource):
     def get(self, tid):
         """团队成员查看团队问卷列表"""
 
-        self.reqparser.add_argument('page', type=int, default=1, location='args')
-        args = self.reqparser.parse_args(strict=True)
+        args = page_parser.parse_args(strict=True)
 
-        team = Team.query.get_or_404(tid)
-        user = g.current_user
-
-        if not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的问卷')
-
-        pagination = team.questionnaires.order_by(Questionnaire.datetime.desc()).paginate(
-            page=args.page,
-            per_page=QUESTIONNAIRE_PER_PAGE
-        )
+        team = member_or_403(Team, tid, g.current_user.id, '不可查看其他团队的问卷')
 
-        data = {'pages': pagination.pages, 'total': pagination.total,
-                'questionnaire': marshal(pagination.items, questionnaire_fields)}
+        items, data = paginate(team.questionnaires, Questionnaire, args, QUESTIONNAIRE_PER_PAGE)
+        data['questionnaire'] = marshal(mark_filled(items, g.current_user.username), questionnaire_fields)
 
         response = {'code': 0, 'message': '', 'data': data}
         return response, 200
@@ -162,36 +226,30 @@ class QuestionnaireListAPI(Resource):
 class QuestionnaireAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def get(self, qid):
         """
         团队成员查看单个问卷，仅返回题目部分，与 QuestionnaireListAPI.get 互补
         考虑到问卷一发布就不可修改，应该没必要像 Task.get 一样再次连简要信息一起返回
         """
 
-        questionnaire = Questionnaire.query.get_or_404(qid)
-        user = g.current_user
-
-        if not db.session.query(questionnaire.team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的问卷')
+        questionnaire, version = versioned_or_403(Questionnaire, qid, g.current_user.id, '不可查看其他团队的问卷')
+        etag = team_etag(questionnaire.team_id, version)
+        rv = not_modified(etag)
+        if rv is not None:
+            return rv
 
-        response = {'code': 0, 'message': '', 'data': [marshal(q, question_fields) for q in questionnaire.questions]}
-        return response, 200
+        data = response_cache.get_or_build('questionnaire', questionnaire.team_id, version,
+                                           lambda: [marshal(q, question_fields) for q in questionnaire.questions])
+        response = {'code': 0, 'message': '', 'data': data}
+        return response, 200, etag_headers(etag)
 
     def post(self, qid):
         """团队成员填写问卷"""
 
-        self.reqparser.add_argument('answers', type=list, required=True, location='json')
-        # answers 应是答案列表，里面每个对象包含题号qid、类型type、内容ans
-        args = self.reqparser.parse_args(strict=True)
+        args = questionnaire_post_parser.parse_args(strict=True)
 
-        questionnaire = Questionnaire.query.get_or_404(qid)
         user = g.current_user
-
-        if not db.session.query(questionnaire.team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可填写其他团队的问卷')
+        questionnaire = member_or_403(Questionnaire, qid, user.id, '不可填写其他团队的问卷')
 
         if datetime.now() > questionnaire.deadline:
             raise ForbiddenError('已超过问卷截止时间')
@@ -200,26 +258,22 @@ class QuestionnaireAPI(Resource):
         if db.session.query(questionnaire.records.filter_by(username=user.username).exists()).scalar():
             raise ForbiddenError('你已填写了该问卷')
 
+        types = dict(db.session.query(QQuestion.qid, QQuestion.type).filter(QQuestion.questionnaire_id == qid))
+        answers = check_answers(args.answers, types)
+        # 简答题可选时提交空字符串
+
         record = QRecord(username=user.username)
         questionnaire.records.append(record)
-
-        try:
-            for answer in args.answers:
-                if 'ans' in answer:
-                    answer['ans'] = str(answer['ans'])  # 选择题题号以str形式存
-                a = QAnswer(**answer)
-                record.answers.append(a)
-
-        except TypeError as e:
-            ee = "多余参数: " + re.findall(r"'(.*?)' is", str(e))[0]
-            raise BadRequestError(ee)
-
-        try:
-            db.session.add(record)
-            db.session.commit()
-        except IntegrityError as e:
-            ee = "缺失参数: " + re.findall(r"Column \\\'(\w+)\\\'", repr(e))[0]
-            raise BadRequestError(ee)
+        db.session.add(record)
+        db.session.flush()
+
+        count_choices(qid, answers)  # 需在答案转为str之前
+        if answers:
+            db.session.execute(QAnswer.__table__.insert(), [
+                dict(a, ans=str(a['ans']), record_id=record.id) for a in answers
+                # 选择题题号以str形式存
+            ])
+        db.session.commit()
 
         response = {'code': 0, 'message': ''}
         return response, 201
@@ -227,11 +281,8 @@ class QuestionnaireAPI(Resource):
     def delete(self, qid):
         """团队队长删除单个问卷"""
 
-        questionnaire = Questionnaire.query.get_or_404(qid)
         user = g.current_user
-
-        if not questionnaire.team.leader == user.id:
-            raise ForbiddenError('仅团队队长可删除问卷')
+        questionnaire = leader_or_403(Questionnaire, qid, user.id, '仅团队队长可删除问卷')
 
         team = questionnaire.team
         team.questionnaires.remove(questionnaire)
@@ -247,26 +298,113 @@ class QuestionnaireAPI(Resource):
         return response, 200
 
 
+def decode_answer(type_, ans):
+    """恢复单选多选答案的格式；加入校验之前存下的不合法答案原样返回，以免响应头发出后才出错"""
+    if type_ in (1, 2,):
+        try:
+            return json_loads(ans)
+        except (TypeError, ValueError):
+            pass
+    return ans
+
+
+def iter_records(qid):
+    """
+    一条 LEFT JOIN 查询取出问卷的全部记录及答案，按记录分组逐条产出
+    产出的结构与原 record_fields 一致: {username, datetime, answers: [{qid, type, ans}]}
+    """
+
+    rows = db.session.query(
+        QRecord.id, QRecord.username, QRecord.datetime, QAnswer.qid, QAnswer.type, QAnswer.ans
+    ).outerjoin(QAnswer, QAnswer.record_id == QRecord.id).filter(
+        QRecord.questionnaire_id == qid
+    ).order_by(QRecord.id, QAnswer.id).yield_per(500)
+
+    for _, group in groupby(rows, key=lambda r: r.id):
+        group = list(group)
+        first = group[0]
+        answers = [{
+            'qid': r.qid,
+            'type': r.type,
+            'ans': decode_answer(r.type, r.ans),
+        } for r in group if r.qid is not None]
+
+        yield {
+            'username': first.username,
+            'datetime': first.datetime.isoformat() if first.datetime else None,
+            'answers': answers,
+        }
+
+
+def stream_json(records):
+    yield '{"code":0,"message":"","data":['
+    for i, r in enumerate(records):
+        yield (',' if i else '') + compact_dumps(r)
+    yield ']}'
+
+
+def stream_csv(records, qids):
+    """每行一个填写者，各题一列；多选答案以 ; 分隔"""
+    buf = StringIO()
+    writer = csv.writer(buf)
+
+    def flush():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return data
+
+    writer.writerow(['username', 'datetime'] + [f'Q{i}' for i in qids])
+    yield '\ufeff' + flush()  # BOM，方便excel识别utf-8
+
+    for r in records:
+        ans = {}
+        for a in r['answers']:
+            ans[a['qid']] = ';'.join(map(str, a['ans'])) if isinstance(a['ans'], list) else a['ans']
+        writer.writerow([r['username'], r['datetime']] + [ans.get(i, '') for i in qids])
+        yield flush()
+
+
 class QuestionnaireRecAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
+    def get(self, qid):
+        """
+        团队队长获取该问卷调查结果，非匿名
+        结果以流的形式返回，format=csv 时导出为csv文件
+        """
+
+        args = records_get_parser.parse_args(strict=True)
+        questionnaire = leader_or_403(Questionnaire, qid, g.current_user.id, '仅团队队长可查看结果')
+
+        records = iter_records(qid)
+
+        if args.format == 'csv':
+            qids = [q.qid for q in questionnaire.questions.with_entities(QQuestion.qid).order_by(QQuestion.qid)]
+            headers = {'Content-Disposition': f'attachment; filename=questionnaire_{qid}.csv'}
+            return Response(stream_with_context(stream_csv(records, qids)),
+                            mimetype='text/csv', headers=headers)
+
+        return Response(stream_with_context(stream_json(records)), mimetype='application/json')
+
+
+class QuestionnaireSummaryAPI(Resource):
+    decorators = [auth.login_required]
 
     def get(self, qid):
-        """团队队长获取该问卷调查结果，非匿名"""
+        """团队队长获取选择题各选项的统计结果，直接读取预先累计的 q_tallies"""
 
-        questionnaire = Questionnaire.query.get_or_404(qid)
-        user = g.current_user
+        questionnaire = leader_or_403(Questionnaire, qid, g.current_user.id, '仅团队队长可查看结果')
 
-        if not questionnaire.team.leader == user.id:
-            raise ForbiddenError('仅团队队长可查看结果')
+        tallies = questionnaire.tallies.order_by(QTally.qid, QTally.oid)
+        data = [{'qid': k, 'options': marshal(list(group), tally_fields)}
+                for k, group in groupby(tallies, key=lambda t: t.qid)]
 
-        # response = {'code': 0, 'message': '', 'data': marshal(questionnaire.records.all(), record_fields)}
-        response = {'code': 0, 'message': '', 'data': [marshal(r, record_fields) for r in questionnaire.records]}
+        response = {'code': 0, 'message': '', 'data': data}
         return response, 200
 
 
 api.add_resource(QuestionnaireListAPI, '/teams/<int:tid>/questionnaires')
 api.add_resource(QuestionnaireAPI, '/questionnaires/<int:qid>')
 api.add_resource(QuestionnaireRecAPI, '/questionnaires/<int:qid>/records')
+api.add_resource(QuestionnaireSummaryAPI, '/questionnaires/<int:qid>/summary')
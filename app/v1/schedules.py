@@ -1,11 +1,15 @@
 from flask import g
-from flask_restful import Resource, reqparse, inputs, marshal, fields
+from flask_restful import Resource, inputs, fields
 
 from . import api
 from ..models import Schedule, Team, Log, object_alter
-from .. import db
+from .. import db, response_cache
 from .decorators import auth
 from .exceptions import ForbiddenError
+from .membership import versioned_or_403, leader_or_403
+from .parsers import RequestParser
+from .serializers import marshal
+from .conditional import team_etag, not_modified, etag_headers
 
 from datetime import date as Date
 from sqlalchemy import not_, or_
@@ -20,21 +24,30 @@ schedule_fields = {
     # 'team_id': fields.String,  # 反正只能取本团队的，该字段无意义
 }
 
+schedules_post_parser = RequestParser()
+schedules_post_parser.add_argument('desc', type=str, required=True, location='json')
+schedules_post_parser.add_argument('urgency', type=inputs.int_range(1, 3), required=True, location='json')
+# urgency是紧急程度，分三级
+schedules_post_parser.add_argument('start', type=inputs.date, required=True, location='json')
+schedules_post_parser.add_argument('end', type=inputs.date, required=True, location='json')
+# 该日程的时期跨度，格式：2020-03-01 的字符串
+
+schedules_get_parser = RequestParser()
+schedules_get_parser.add_argument('year', type=int, required=True, location='args')
+schedules_get_parser.add_argument('month', type=inputs.int_range(1, 12), required=True, location='args')
+
+schedule_patch_parser = RequestParser()
+schedule_patch_parser.add_argument('desc', type=str, required=False, location='json')
+schedule_patch_parser.add_argument('urgency', type=inputs.int_range(1, 3), required=False, location='json')
+schedule_patch_parser.add_argument('start', type=inputs.date, required=False, location='json')
+schedule_patch_parser.add_argument('end', type=inputs.date, required=False, location='json')
+
 
 class ScheduleListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def post(self, tid):
-        self.reqparser.add_argument('desc', type=str, required=True, location='json')
-        self.reqparser.add_argument('urgency', type=inputs.int_range(1, 3), required=True, location='json')
-        # urgency是紧急程度，分三级
-        self.reqparser.add_argument('start', type=inputs.date, required=True, location='json')
-        self.reqparser.add_argument('end', type=inputs.date, required=True, location='json')
-        # 该日程的时期跨度，格式：2020-03-01 的字符串
-        args = self.reqparser.parse_args(strict=True)
+        args = schedules_post_parser.parse_args(strict=True)
 
         team = Team.query.get_or_404(tid)
         user = g.current_user
@@ -55,13 +68,13 @@ class ScheduleListAPI(Resource):
         return response, 201
 
     def get(self, tid):
-        self.reqparser.add_argument('year', type=int, required=True, location='args')
-        self.reqparser.add_argument('month', type=inputs.int_range(1, 12), required=True, location='args')
-        args = self.reqparser.parse_args(strict=True)
+        args = schedules_get_parser.parse_args(strict=True)
 
-        team = Team.query.get_or_404(tid)
-        if not db.session.query(team.users.filter_by(id=g.current_user.id).exists()).scalar():
-            raise ForbiddenError('不可获取其他团队的日程')
+        team, version = versioned_or_403(Team, tid, g.current_user.id, '不可获取其他团队的日程')
+        etag = team_etag(tid, version)
+        rv = not_modified(etag)
+        if rv is not None:
+            return rv
 
         y, m = args.year, args.month
         days_of_month = [-1, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
@@ -73,26 +86,18 @@ class ScheduleListAPI(Resource):
         schedules = team.schedules.filter(not_(or_(Schedule.start > end, Schedule.end < start)))
         # 筛选出日期跨度与该月有交集的所有日程
 
-        response = {'code': 0, 'message': '', 'data': marshal(schedules.all(), schedule_fields)}
-        return response, 200
+        data = response_cache.get_or_build('schedules', tid, version, lambda: marshal(schedules.all(), schedule_fields))
+        response = {'code': 0, 'message': '', 'data': data}
+        return response, 200, etag_headers(etag)
 
 
 class ScheduleAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def patch(self, sid):
-        self.reqparser.add_argument('desc', type=str, required=False, location='json')
-        self.reqparser.add_argument('urgency', type=inputs.int_range(1, 3), required=False, location='json')
-        self.reqparser.add_argument('start', type=inputs.date, required=False, location='json')
-        self.reqparser.add_argument('end', type=inputs.date, required=False, location='json')
-        args = self.reqparser.parse_args(strict=True)
+        args = schedule_patch_parser.parse_args(strict=True)
 
-        schedule = Schedule.query.get_or_404(sid)
-        if g.current_user.id != schedule.team.leader:
-            raise ForbiddenError('仅队长可修改日程')
+        schedule = leader_or_403(Schedule, sid, g.current_user.id, '仅队长可修改日程')
 
         log = Log(uid=g.current_user.id, desc=f'修改了日程: {schedule.desc}')
         object_alter(schedule, args)
@@ -106,9 +111,7 @@ class ScheduleAPI(Resource):
         return response, 200
 
     def delete(self, sid):
-        schedule = Schedule.query.get_or_404(sid)
-        if g.current_user.id != schedule.team.leader:
-            raise ForbiddenError('仅队长可删除日程')
+        schedule = leader_or_403(Schedule, sid, g.current_user.id, '仅队长可删除日程')
 
         log = Log(uid=g.current_user.id, desc=f'删除了日程: {schedule.desc}')
         schedule.team.logs.append(log)
@@ -0,0 +1,220 @@
+from flask import g, url_for, request
+from flask_restful import fields
+from flask_restful.fields import _get_value_for_key, _rfc822
+from werkzeug.urls import url_quote, url_quote_plus
+
+# flask_restful.marshal 每个对象都要逐个字段 make/output/get_value，嵌套的再递归一遍
+# 这里把字段表编译成函数，常用字段直接取值格式化，其余字段仍调用其 output，输出与 marshal 完全一致
+
+_MARK = 'urlaffixmark'
+
+
+def url_affixes(endpoint, arg, external, values):
+    """
+    同一请求内每种链接只 url_for 一次，得到可变参数前后的固定部分及该参数的编码方式
+    值在路径中按路由转换器的方式编码，在查询串中则按 url_encode 的方式
+    """
+
+    key = (request.host_url, endpoint, arg, external, tuple(sorted(values.items())))
+    cache = g.setdefault('url_affixes', {})
+    affixes = cache.get(key)
+    if affixes is None:
+        url = url_for(endpoint, _external=external, **{arg: _MARK}, **values)
+        prefix, suffix = url.split(_MARK, 1)
+        quote = (lambda v: url_quote_plus(v, safe='')) if '?' in prefix else url_quote
+        affixes = cache[key] = (prefix, suffix, quote)
+    return affixes
+
+
+class AffixUrl(fields.Url):
+    """
+    只有一个参数随对象变化的链接字段，直接拼接记下的前后缀，不必每项都 url_for
+    子类给出 arg(随对象变化的参数名)，按需覆盖 endpoint_for 与 values
+    """
+
+    arg = None
+
+    def endpoint_for(self, obj):
+        return self.endpoint
+
+    def values(self):
+        """其余固定的 url_for 参数"""
+        return {}
+
+    def output(self, key, obj):
+        value = getattr(obj, key if self.attribute is None else self.attribute)
+        endpoint = self.endpoint_for(obj)
+        if value is None:
+            # 与 url_for 的行为保持一致(缺参数时报错)
+            return url_for(endpoint, _external=self.absolute, **{self.arg: value}, **self.values())
+
+        prefix, suffix, quote = url_affixes(endpoint, self.arg, self.absolute, self.values())
+        return prefix + quote(str(value)) + suffix
+
+
+_formats = {
+    fields.Integer: int,
+    fields.String: str,
+    fields.Boolean: bool,
+    fields.Raw: None,
+}
+
+
+def _format_of(field):
+    t = type(field)
+    if t is fields.DateTime:
+        if field.dt_format == 'iso8601':
+            return lambda v: v.isoformat()
+        if field.dt_format == 'rfc822':
+            return _rfc822
+    return _formats.get(t, False)
+
+
+def _many(serialize, value):
+    if isinstance(value, (list, tuple)):
+        return [serialize(v) for v in value]
+    return serialize(value)
+
+
+def _compile_field(key, field):
+    """返回 (按属性取值的函数, 按下标取值的函数)，对应 get_value 对普通对象与可索引对象的两种处理"""
+
+    if isinstance(field, dict):
+        nested = compile_fields(field)
+
+        def many(obj):
+            return _many(nested, obj)
+        return many, many
+
+    if isinstance(field, type):
+        field = field()
+    attr = key if field.attribute is None else field.attribute
+
+    def by_index(obj):
+        return _get_value_for_key(attr, obj, None)
+
+    def by_attr(obj):
+        return getattr(obj, attr, None)
+
+    def by_field(obj):
+        return field.output(key, obj)
+
+    if not isinstance(attr, str) or '.' in attr:
+        return by_field, by_field
+
+    t = type(field)
+    if t is fields.Nested:
+        nested = _nested_output(field)
+
+        def build(get):
+            return lambda obj: nested(get(obj))
+    elif t is fields.List and type(field.container) is fields.Nested and field.container.attribute is None:
+        item = _nested_output(field.container)
+        single = compile_fields(field.container.nested)
+        default = field.default
+
+        def build(get):
+            def output(obj):
+                value = get(obj)
+                if value is None:
+                    return default
+                if isinstance(value, dict) or not hasattr(value, '__iter__') or hasattr(value, 'strip'):
+                    return [single(value)]
+                # 直接迭代，dynamic 关系不会像 List.format 那样按下标逐条查询
+                return [item(v) for v in value]
+            return output
+    else:
+        fmt = _format_of(field)
+        if fmt is False:
+            return by_field, by_field
+        default = field.default
+
+        def build(get):
+            if fmt is None:
+                def output(obj):
+                    value = get(obj)
+                    return default if value is None else value
+            else:
+                def output(obj):
+                    value = get(obj)
+                    return default if value is None else fmt(value)
+            return output
+
+    return build(by_attr), build(by_index)
+
+
+def _nested_output(field):
+    """fields.Nested 对已取出的值的处理，返回 值->输出 的函数"""
+
+    nested = compile_fields(field.nested)
+    allow_null, default = field.allow_null, field.default
+
+    def output(value):
+        if value is None:
+            if allow_null:
+                return None
+            elif default is not None:
+                return default
+        return _many(nested, value)
+
+    return output
+
+
+def compile_fields(spec):
+    """把字段表编译为 对象->dict 的函数"""
+
+    parts = [(key, _compile_field(key, field)) for key, field in spec.items()]
+    by_attr = [(key, f[0]) for key, f in parts]
+    by_index = [(key, f[1]) for key, f in parts]
+
+    def serialize(obj):
+        if not hasattr(obj, 'strip') and hasattr(obj, '__iter__'):
+            return {key: f(obj) for key, f in by_index}
+        return {key: f(obj) for key, f in by_attr}
+
+    return serialize
+
+
+_compiled = {}
+
+
+def marshal(data, spec, envelope=None):
+    """flask_restful.marshal 的替代，同一字段表只编译一次"""
+
+    entry = _compiled.get(id(spec))
+    if entry is None or entry[0] is not spec:
+        if len(_compiled) > 256:
+            _compiled.clear()
+        entry = _compiled[id(spec)] = (spec, compile_fields(spec))
+    data = _many(entry[1], data)
+    return {envelope: data} if envelope else data
+
+
+def field_names(spec):
+    """reqparse 的 type：逗号分隔的字段名 -> frozenset，只允许 spec 中已有的字段"""
+
+    def parse(value):
+        names = frozenset(n.strip() for n in value.split(',') if n.strip())
+        unknown = names - spec.keys()
+        if unknown:
+            raise ValueError('未知字段 ' + ','.join(sorted(unknown)))
+        return names
+    return parse
+
+
+_projections = {}
+
+
+def project(spec, names):
+    """
+    字段表中只保留 names 中的字段(保持原顺序)，names 为 None 时原样返回
+    同一组合总是返回同一个字段表，编译结果得以复用，组合数受字段数限制
+    """
+
+    if names is None:
+        return spec
+    key = (id(spec), names)
+    sub = _projections.get(key)
+    if sub is None:
+        sub = _projections[key] = {k: v for k, v in spec.items() if k in names}
+    return sub
@@ -1,17 +1,23 @@
-from flask import g, url_for
-from flask_restful import Resource, reqparse, inputs, marshal, fields
+from flask import g, request, Response
+from flask_restful import Resource, inputs, fields
+from sqlalchemy import or_
 
 from . import api
 from ..models import Team, Task, Archive, Log, object_alter
-from .. import db
+from .. import db, storage, response_cache
 from .decorators import auth
 from .exceptions import ForbiddenError, NotFound
+from .membership import get_or_404, member_or_403, versioned_or_403, leader_or_403
+from .pagination import paginate, page_parser
+from .parsers import RequestParser
+from .serializers import AffixUrl, marshal
+from .conditional import team_etag, not_modified, etag_headers
 
-from config import TASK_PER_PAGE, FILE_PER_PAGE, Config
+from config import TASK_PER_PAGE, FILE_PER_PAGE, ARCHIVE_BLOB_DIR
 from werkzeug.datastructures import FileStorage
+from io import BytesIO
 from uuid import uuid4
 from datetime import datetime
-from os import remove, path
 
 
 # task提供任务信息，每个task尤其仅有一个执行者，archive存task可能需要上交的文件
@@ -28,16 +34,11 @@ task_fields = {
 }
 
 
-class ArchiveUrl(fields.Url):
-    def output(self, key, obj):
-        value = getattr(obj, key if self.attribute is None else self.attribute)
-        endpoint = ('v1.archive', 'main.get_archive')[obj.type == 3]
-        return url_for(endpoint, _external=self.absolute, filename=value)
+class ArchiveUrl(AffixUrl):
+    arg = 'filename'
 
-
-class ArchiveItem(fields.Raw):
-    def format(self, value):
-        return marshal(value, archive_fields)
+    def endpoint_for(self, obj):
+        return ('v1.archive', 'main.get_archive')[obj.type == 3]
 
 
 archive_fields = {
@@ -48,31 +49,51 @@ archive_fields = {
     'archive_url': ArchiveUrl(attribute='filename', absolute=True)
 }
 task_detail_fields = task_fields.copy()
-task_detail_fields['archives'] = fields.List(ArchiveItem, attribute='archives')
+task_detail_fields['archives'] = fields.List(fields.Nested(archive_fields), attribute='archives')
+
+tasks_post_parser = RequestParser()
+tasks_post_parser.add_argument('title', type=str, required=True, location='json')
+tasks_post_parser.add_argument('desc', type=str, location='json')
+tasks_post_parser.add_argument('assignee', type=int, required=True, location='json')
+tasks_post_parser.add_argument('deadline', type=inputs.datetime_from_iso8601, required=True, location='json')
+
+tasks_get_parser = page_parser.copy()
+tasks_get_parser.add_argument('status', type=inputs.int_range(0, 2), default=2, location='args')
+# 未完成、完成、全部 对应 0、1、2
+tasks_get_parser.add_argument('uid', type=int, default=0, location='args')
+# 仅返回该用户的任务，放空(此时为0)则返回全部的
+
+task_post_parser = RequestParser()
+task_post_parser.add_argument('text', type=str, dest='content', location=['json', 'form'])
+task_post_parser.add_argument('file', type=FileStorage, location='files')
+task_post_parser.add_argument('type', type=inputs.int_range(1, 3), location=['json', 'form'])
+# 当不带type参数，则表示没有需要提交的文件
+task_post_parser.add_argument('name', type=str, location=['json', 'form'])
+# 文件名，不带后缀（区别于archive.filename，后者是生成的uuid，用于url，且有后缀）
+task_post_parser.add_argument('finish', type=inputs.boolean, required=True, location=['json', 'form'])
+
+task_patch_parser = RequestParser()
+task_patch_parser.add_argument('title', type=str, location='json')
+task_patch_parser.add_argument('desc', type=str, location='json')
+task_patch_parser.add_argument('assignee', type=int, location='json')
+task_patch_parser.add_argument('deadline', type=inputs.datetime_from_iso8601, location='json')
 
 
 class TaskListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def post(self, tid):
         """团队队长向特定成员发布工作任务"""
 
-        self.reqparser.add_argument('title', type=str, required=True, location='json')
-        self.reqparser.add_argument('desc', type=str, location='json')
-        self.reqparser.add_argument('assignee', type=int, required=True, location='json')
-        self.reqparser.add_argument('deadline', type=inputs.datetime_from_iso8601, required=True, location='json')
-        args = self.reqparser.parse_args(strict=True)
+        args = tasks_post_parser.parse_args(strict=True)
 
-        team = Team.query.get_or_404(tid)
+        team, assignee_joined = get_or_404(Team, tid, args.assignee)
         user = g.current_user
 
         if team.leader != user.id:
             raise ForbiddenError('仅本团队队长可发布工作任务')
 
-        if not db.session.query(team.users.filter_by(id=args.assignee).exists()).scalar():
+        if not assignee_joined:
             raise ForbiddenError('所选的负责人不是团队成员')
 
         t = Task(**args)
@@ -90,18 +111,13 @@ class TaskListAPI(Resource):
     def get(self, tid):
         """团队成员查看团队任务"""
 
-        self.reqparser.add_argument('status', type=inputs.int_range(0, 2), default=2, location='args')
-        # 未完成、完成、全部 对应 0、1、2
-        self.reqparser.add_argument('uid', type=int, default=0, location='args')
-        # 仅返回该用户的任务，放空(此时为0)则返回全部的
-        self.reqparser.add_argument('page', type=int, default=1, location='args')
-        args = self.reqparser.parse_args(strict=True)
-
-        team = Team.query.get_or_404(tid)
-        user = g.current_user
+        args = tasks_get_parser.parse_args(strict=True)
 
-        if not db.session.query(team.users.filter_by(id=user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的任务')
+        team, version = versioned_or_403(Team, tid, g.current_user.id, '不可查看其他团队的任务')
+        etag = team_etag(tid, version)
+        rv = not_modified(etag)
+        if rv is not None:
+            return rv
 
         query = team.tasks
         if args.status in (0, 1,):
@@ -110,50 +126,56 @@ class TaskListAPI(Resource):
             # 由于只能给本团队成员发任务，当uid不是该团队成员自然没有记录
             query = query.filter_by(assignee=args.uid)
 
-        pagination = query.order_by(Task.datetime.desc()).paginate(
-            page=args.page,
-            per_page=TASK_PER_PAGE
-        )
-
-        data = {'pages': pagination.pages, 'total': pagination.total,
-                'tasks': marshal(pagination.items, task_fields)}
+        def build():
+            items, data = paginate(query, Task, args, TASK_PER_PAGE)
+            data['tasks'] = marshal(items, task_fields)
+            return data
 
+        data = response_cache.get_or_build('tasks', tid, version, build)
         response = {'code': 0, 'message': '', 'data': data}
-        return response, 200
+        return response, 200, etag_headers(etag)
+
+
+ARCHIVE_EXT = (None, 'md', 'rtf')
+ARCHIVE_MIMETYPE = (None, 'text/markdown', 'application/rtf')
 
 
 def store_archive(file):
+    """
+    文件在数据库提交后才出现在 archives/ 下，返回 (文件名, blob名)
+    相同内容只存一份blob，archives/<文件名> 是指向它的硬链接
+    """
     filename = file.filename.rstrip('"')
     # 很奇怪，当文件名带中文时后缀有多余的"，如 'xxx.doc"'
     name = uuid4().hex + '.' + filename.rsplit('.', 1)[1]
-    file.save(Config.UPLOADED_FILES_DEST + f'archives/{name}')
-    return name
+    blob = storage.save_blob(file, f'archives/{name}', ARCHIVE_BLOB_DIR)
+    return name, blob
 
 
 def remove_archive(archives):
+    """数据库提交后才在后台删除；blob仅在最后一个引用它的Archive删除时才删"""
     for a in archives:
-        p = Config.UPLOADED_FILES_DEST + f'archives/{a.filename}'
-        if path.isfile(p):
-            remove(p)
+        storage.remove(f'archives/{a.filename}')
+
+    blobs = {a.blob for a in archives if a.blob}
+    if not blobs:
+        return
+    ids = [a.id for a in archives]
+    with db.session.no_autoflush:
+        # 调用方可能已把这些Archive移出集合，不在此提前flush
+        shared = {r.blob for r in db.session.query(Archive.blob).filter(
+            Archive.blob.in_(blobs), Archive.id.notin_(ids)).distinct()}
+    for blob in blobs - shared:
+        storage.remove(f'{ARCHIVE_BLOB_DIR}/{blob}')
 
 
 class TaskAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-
     def post(self, tid):
         """该任务负责人在此提交文件、设置完成状态"""
 
-        self.reqparser.add_argument('text', type=str, dest='content', location=['json', 'form'])
-        self.reqparser.add_argument('file', type=FileStorage, location='files')
-        self.reqparser.add_argument('type', type=inputs.int_range(1, 3), location=['json', 'form'])
-        # 当不带type参数，则表示没有需要提交的文件
-        self.reqparser.add_argument('name', type=str, location=['json', 'form'])
-        # 文件名，不带后缀（区别于archive.filename，后者是生成的uuid，用于url，且有后缀）
-        self.reqparser.add_argument('finish', type=inputs.boolean, required=True, location=['json', 'form'])
-        args = self.reqparser.parse_args(strict=True)
+        args = task_post_parser.parse_args(strict=True)
 
         task = Task.query.get_or_404(tid)
         user = g.current_user
@@ -173,11 +195,13 @@ class TaskAPI(Resource):
         else:
             # 需要提交文档/文件时
             if args.type in (1, 2,) and args.get('content'):
-                args.filename = uuid4().hex + '.' + ('', 'md', 'rtf')[args.type]
+                # 文本同样作为blob存于硬盘，数据库只记文件名
+                text = FileStorage(BytesIO(args.pop('content').encode()), 'text.' + ARCHIVE_EXT[args.type])
+                args.filename, args.blob = store_archive(text)
 
             elif args.type == 3 and file:
                 # 非文本字符串(md/rtf)存于硬盘，文件名写入数据库
-                args.filename = store_archive(file)
+                args.filename, args.blob = store_archive(file)
             else:
                 raise ForbiddenError('文件缺失')
 
@@ -206,26 +230,16 @@ class TaskAPI(Resource):
         return response, 201
 
     def get(self, tid):
-        task = Task.query.get_or_404(tid)
-
-        if not db.session.query(task.team.users.filter_by(id=g.current_user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的任务')
+        task = member_or_403(Task, tid, g.current_user.id, '不可查看其他团队的任务')
 
         response = {'code': 0, 'message': '', 'data': marshal(task, task_detail_fields)}
         return response, 200
 
     def patch(self, tid):
-        self.reqparser.add_argument('title', type=str, location='json')
-        self.reqparser.add_argument('desc', type=str, location='json')
-        self.reqparser.add_argument('assignee', type=int, location='json')
-        self.reqparser.add_argument('deadline', type=inputs.datetime_from_iso8601, location='json')
-        args = self.reqparser.parse_args(strict=True)
+        args = task_patch_parser.parse_args(strict=True)
 
-        task = Task.query.get_or_404(tid)
         user = g.current_user
-
-        if task.team.leader != user.id:
-            raise ForbiddenError('仅本团队队长可修改工作任务')
+        task = leader_or_403(Task, tid, user.id, '仅本团队队长可修改工作任务')
 
         object_alter(task, args)
         task.datetime = datetime.now()
@@ -242,12 +256,10 @@ class TaskAPI(Resource):
     def delete(self, tid):
         """注意，删除任务后它关联的文档也会被删除"""
 
-        task = Task.query.get_or_404(tid)
-
-        if task.team.leader != g.current_user.id:
-            raise ForbiddenError('仅本团队队长可删除工作任务')
+        task = leader_or_403(Task, tid, g.current_user.id, '仅本团队队长可删除工作任务')
 
-        archives = task.archives.filter_by(type=3).all()
+        archives = task.archives.filter(or_(Archive.blob.isnot(None), Archive.type == 3)).all()
+        # 有文件的：已并入blob的，及尚未dedup的旧文件类(只有 archives/<文件名>)
         remove_archive(archives)
 
         log = Log(uid=g.current_user.id, desc=f'删除了任务: {task.title}')
@@ -264,26 +276,14 @@ class TaskAPI(Resource):
 class ArchiveListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparser = reqparse.RequestParser()
-        self.reqparser.add_argument('page', type=int, default=1, location='args')
-
     def get(self, tid):
         """获取某个团队的所有文件，分页"""
 
-        args = self.reqparser.parse_args(strict=True)
-        team = Team.query.get_or_404(tid)
+        args = page_parser.parse_args(strict=True)
+        team = member_or_403(Team, tid, g.current_user.id, '不可查看其他团队的文件')
 
-        if not db.session.query(team.users.filter_by(id=g.current_user.id).exists()).scalar():
-            raise ForbiddenError('不可查看其他团队的文件')
-
-        pagination = team.archives.order_by(Archive.datetime.desc()).paginate(
-            page=args.page,
-            per_page=FILE_PER_PAGE
-        )
-
-        data = {'pages': pagination.pages, 'total': pagination.total,
-                'archives': marshal(pagination.items, archive_fields)}
+        items, data = paginate(team.archives, Archive, args, FILE_PER_PAGE)
+        data['archives'] = marshal(items, archive_fields)
 
         response = {'code': 0, 'message': '', 'data': data}
         return response, 200
@@ -292,7 +292,7 @@ class ArchiveListAPI(Resource):
 class ArchiveAPI(Resource):
     """
     仅实现获取与删除，若修改则先删除再重建
-    type=3，即文件类无法在此由get得到，它由nginx代理。但简单起见，文件却是由此处的delete删除...
+    type=3，即文件类无法在此由get得到，它由 main.get_archive(或nginx)提供。但简单起见，文件却是由此处的delete删除...
     """
 
     decorators = [auth.login_required]
@@ -300,31 +300,45 @@ class ArchiveAPI(Resource):
     def get(self, filename):
         """
         关于Archive的属性都能在 'get task' 中获取，故与nginx一样，这里仅返回文本本身
+        以内容哈希作ETag，支持 If-None-Match、Range 与 gzip，流式读取不整体载入内存
         若是type=3的文件类则返回空字符串
         """
 
-        a = Archive.query.filter(Archive.filename == filename).first()
+        a = db.session.query(Archive.id, Archive.type, Archive.filename, Archive.blob).filter(
+            Archive.filename == filename).first()
         if a is None:
             raise NotFound('该文档不存在')
+        if a.type == 3:
+            return '', 200
 
-        return a.content, 200
+        mimetype = ARCHIVE_MIMETYPE[a.type]
+        if a.blob is None:
+            # 尚未迁移到blob的旧数据
+            content = db.session.query(Archive.content).filter(Archive.id == a.id).scalar() or ''
+            rv = Response(content, mimetype=mimetype)
+            rv.add_etag()
+            return rv.make_conditional(request)
+
+        # 读本文档自己的硬链接，blob名(内容哈希)仅作ETag
+        return storage.send(f'archives/{a.filename}', a.blob.split('.')[0], mimetype, compress=True)
 
     def delete(self, filename):
         """按文件名删除某个文档/文件"""
 
-        a = Archive.query.filter(Archive.filename == filename).first()
-        if a is None:
+        row = db.session.query(Archive, Task, Team.leader).join(Task, Task.id == Archive.task_id).join(
+            Team, Team.id == Task.team_id).filter(Archive.filename == filename).first()
+        # 文档、所属任务与团队队长一条SQL取出
+        if row is None:
             raise NotFound('该文档不存在')
 
-        task = a.task
+        a, task, leader = row
         user = g.current_user
 
-        if user.id not in (task.team.leader, task.assignee):
+        if user.id not in (leader, task.assignee):
             raise ForbiddenError('仅队长或其发布者可删除')
 
         task.archives.remove(a)
-        if a.type == 3:
-            remove_archive([a])
+        remove_archive([a])
 
         db.session.delete(a)
         db.session.commit()
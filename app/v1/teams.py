@@ -1,30 +1,58 @@
-from flask import g, url_for
-from flask_restful import Resource, reqparse, fields, marshal
+from flask import g
+from flask_restful import Resource, fields
 
 from . import api
-from .. import db
-from ..models import Team, User, object_alter
+from .. import db, response_cache
+from ..models import Team, User, t_users, object_alter
 from .decorators import auth
 from .exceptions import BadRequestError, ForbiddenError
+from .membership import query_with_membership, get_or_404, versioned_or_403
+from .users import AvatarUrl
+from .parsers import RequestParser
+from .serializers import AffixUrl, marshal, field_names, project
+from .conditional import team_etag, not_modified, etag_headers
+from ..main.sockets import memberships_changed
 
 from datetime import time
 
 user_fields = {
     'id': fields.Integer,
     'name': fields.String,
-    'avatar': fields.Url('main.get_avatar', attribute='avatar', absolute=True),
+    'avatar': AvatarUrl(128, attribute='avatar'),  # 成员列表只需小图
 }
 
 
-class UserItem(fields.Raw):
-    def format(self, value):
-        return marshal(value, user_fields)
+class JoinUrl(AffixUrl):
+    arg = 'inv'
 
 
-class JoinUrl(fields.Url):
-    def output(self, key, obj):
-        value = getattr(obj, key if self.attribute is None else self.attribute)
-        return url_for(self.endpoint, _external=self.absolute, inv=value)
+class Member(object):
+    """成员列表只需的几列，代替完整的 User 对象"""
+
+    __slots__ = ('id', 'name', 'avatar')
+
+    def __init__(self, uid, name, avatar):
+        self.id = uid
+        self.name = name
+        self.avatar = avatar
+
+
+class TeamDetail(object):
+    """团队对象加上已取出的成员列表，供 marshal 读取 users，其余属性取自 team"""
+
+    def __init__(self, team, members):
+        self.team = team
+        self.users = members
+
+    def __getattr__(self, name):
+        return getattr(self.team, name)
+
+
+def team_members(tid):
+    """成员的 id/name/avatar，不加载完整的 User"""
+    rows = db.session.query(User.id, User.name, User.avatar).join(
+        t_users, t_users.c.user_id == User.id).filter(t_users.c.team_id == tid).order_by(t_users.c.user_id)
+    return [Member(*r) for r in rows]
 
 
 team_fields = {
@@ -34,10 +62,33 @@ team_fields = {
     'leader_id': fields.Integer(attribute='leader'),
     'check_s': fields.String,
     'check_e': fields.String,
-    'members': fields.List(UserItem, attribute='users'),
+    'members': fields.List(fields.Nested(user_fields), attribute='users'),
     'inv_url': JoinUrl('v1.join_team', attribute='inv_code', absolute=True)
 }
 
+teams_post_parser = RequestParser()
+teams_post_parser.add_argument('name', type=str, required=True, location='json')
+teams_post_parser.add_argument('desc', type=str, required=False, location='json')
+teams_post_parser.add_argument('check_s', type=str, required=True, location='json')
+teams_post_parser.add_argument('check_e', type=str, required=True, location='json')
+
+team_post_parser = RequestParser()
+team_post_parser.add_argument('action', type=int, required=True, location='json')
+team_post_parser.add_argument('uid', type=int, required=True, location='json')
+
+team_patch_parser = RequestParser()
+team_patch_parser.add_argument('name', type=str, required=False, location='json')
+team_patch_parser.add_argument('desc', type=str, required=False, location='json')
+team_patch_parser.add_argument('check_s', type=str, required=False, location='json')
+team_patch_parser.add_argument('check_e', type=str, required=False, location='json')
+
+team_get_parser = RequestParser()
+team_get_parser.add_argument('fields', type=field_names(team_fields), location='args')
+# 逗号分隔，只返回这些字段，如 fields=id,name 可省去成员列表
+
+join_parser = RequestParser()
+join_parser.add_argument('inv', type=str, required=True, location=['args', 'json'])
+
 
 def time_check(s, e):
     """验证两个time对象/时间字符串是否符合要求"""
@@ -59,46 +110,29 @@ def time_check(s, e):
 class TeamListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqpost = reqparse.RequestParser()
-        self.reqpost.add_argument('name', type=str, required=True, location='json')
-        self.reqpost.add_argument('desc', type=str, required=False, location='json')
-        self.reqpost.add_argument('check_s', type=str, required=True, location='json')
-        self.reqpost.add_argument('check_e', type=str, required=True, location='json')
-        super().__init__()
-
     def post(self):
         """登录用户创建一个团队"""
-        args = self.reqpost.parse_args(strict=True)
+        args = teams_post_parser.parse_args(strict=True)
         args.check_s, args.check_e = time_check(args.check_s, args.check_e)
 
         team = Team(**args)
-        user = g.current_user
+        user = g.current_user.user
         team.users.append(user)
 
         team.leader = user.id
         team.renew_inv_code()
         db.session.add(team)
-        db.session.commit()
+        db.session.flush()  # 取得id，提交前输出，成员即创建者，不必提交后再查一遍
 
-        response = {'code': 0, 'message': '', 'data': marshal(team, team_fields)}
+        response = {'code': 0, 'message': '', 'data': marshal(TeamDetail(team, [user]), team_fields)}
+        db.session.commit()
+        memberships_changed(user.id)
         return response, 201
 
 
 class TeamAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('action', type=int, required=True, location='json')
-        self.reqparse.add_argument('uid', type=int, required=True, location='json')
-        self.reqpatch = reqparse.RequestParser()
-        self.reqpatch.add_argument('name', type=str, required=False, location='json')
-        self.reqpatch.add_argument('desc', type=str, required=False, location='json')
-        self.reqpatch.add_argument('check_s', type=str, required=False, location='json')
-        self.reqpatch.add_argument('check_e', type=str, required=False, location='json')
-        super().__init__()
-
     def post(self, tid):
         """
         对某个团队队长主动拉人/踢人 他人退出 及队长职位转让
@@ -107,10 +141,10 @@ class TeamAPI(Resource):
         注意：加入只能由队长拉入或通过邀请码，不能直接加入
         """
 
-        args = self.reqparse.parse_args(strict=True)
+        args = team_post_parser.parse_args(strict=True)
         action, uid = args['action'], args['uid']
 
-        team = Team.query.get_or_404(tid)
+        team, joined = get_or_404(Team, tid, uid)  # joined: 被操作者是否已加入该团队
         operator = g.current_user
         user = User.query.get_or_404(uid)
 
@@ -123,8 +157,6 @@ class TeamAPI(Resource):
 
         if op_admin or op_self:
             # 队长操作他人 / 他人操作自己
-            joined = db.session.query(team.users.filter_by(id=user.id).exists()).scalar()  # 是否已加入该团队
-
             if action == 1 and op_admin and not joined:
                 team.users.append(user)
             elif action == 2 and joined:
@@ -134,8 +166,11 @@ class TeamAPI(Resource):
             else:
                 raise BadRequestError('请求无效或不满足执行条件')
 
+            team.touch()
             db.session.add(team)
             db.session.commit()
+            if action != 3:
+                memberships_changed(uid)
         else:
             raise BadRequestError('没有权限操作其他团队成员')
 
@@ -143,7 +178,7 @@ class TeamAPI(Resource):
         return response, 200
 
     def patch(self, tid):
-        args = self.reqpatch.parse_args(strict=True)
+        args = team_patch_parser.parse_args(strict=True)
         team = Team.query.get_or_404(tid)
         operator = g.current_user
 
@@ -159,6 +194,7 @@ class TeamAPI(Resource):
             args.check_s, args.check_e = time_check(s, e)
 
         object_alter(team, args)
+        team.touch()
         db.session.add(team)
         db.session.commit()
 
@@ -172,47 +208,56 @@ class TeamAPI(Resource):
         if operator.id != team.leader:
             raise BadRequestError('仅队长可解散团队')
 
+        members = [uid for uid, in db.session.query(t_users.c.user_id).filter(t_users.c.team_id == tid)]
         db.session.delete(team)
         db.session.commit()
+        memberships_changed(*members)
 
         response = {'code': 0, 'message': ''}
         return response, 200
 
     def get(self, tid):
-        team = Team.query.get_or_404(tid)
+        args = team_get_parser.parse_args(strict=True)
+        spec = project(team_fields, args.fields)
 
-        if not db.session.query(team.users.filter_by(id=g.current_user.id).exists()).scalar():
-            raise ForbiddenError('仅成员可查看团队信息')
+        team, version = versioned_or_403(Team, tid, g.current_user.id, '仅成员可查看团队信息')
+        etag = team_etag(tid, version)
+        rv = not_modified(etag)
+        if rv is not None:
+            return rv
 
-        response = {'code': 0, 'message': '', 'data': marshal(team, team_fields)}
-        return response, 200
+        def build():
+            # 成员只取需要的几列
+            return marshal(TeamDetail(team, team_members(tid)) if 'members' in spec else team, spec)
+
+        data = response_cache.get_or_build('team', tid, version, build)
+        response = {'code': 0, 'message': '', 'data': data}
+        return response, 200, etag_headers(etag)
 
 
 class TeamJoinAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('inv', type=str, required=True, location=['args', 'json'])
-        super().__init__()
-
     def get(self):
-        args = self.reqparse.parse_args(strict=True)
-        team = Team.query.filter_by(inv_code=args.inv).first()
+        args = join_parser.parse_args(strict=True)
+        team, joined = query_with_membership(Team, g.current_user.id).filter(
+            Team.inv_code == args.inv).first() or (None, False)
 
         if team is None:
             raise BadRequestError('邀请码错误或过期')
 
-        if not db.session.query(team.users.filter_by(id=g.current_user.id).exists()).scalar():
-            team.users.append(g.current_user)
+        if not joined:
+            team.users.append(g.current_user.user)
+            team.touch()
             db.session.add(team)
             db.session.commit()
+            memberships_changed(g.current_user.id)
 
         response = {'code': 0, 'message': ''}
         return response, 200
 
     def put(self):
-        args = self.reqparse.parse_args(strict=True)
+        args = join_parser.parse_args(strict=True)
         team = Team.query.filter_by(inv_code=args.inv).first()
 
         if team is None:
@@ -222,6 +267,7 @@ class TeamJoinAPI(Resource):
             raise ForbiddenError('仅队长可更新邀请码')
 
         team.renew_inv_code()
+        team.touch()
         db.session.add(team)
         db.session.commit()
 
@@ -1,18 +1,21 @@
 from flask import g, url_for
-from flask_restful import Resource, reqparse, fields, marshal, inputs
+from flask_restful import Resource, fields, inputs
 from flask_uploads import extension
 
 from . import api
-from ..models import User, object_alter
-from .. import db, up_files
-from .decorators import auth
-from .exceptions import UserAlreadyExistsError, IncorrectPasswordError
+from ..models import User, Team, object_alter
+from .. import db, up_files, storage, thumbnails
+from .decorators import auth, token_cache
+from .exceptions import UserAlreadyExistsError, IncorrectPasswordError, BadRequestError
+from .parsers import RequestParser
+from .serializers import AffixUrl, marshal
 
 from werkzeug.datastructures import FileStorage
-from os import remove
-from config import Config, DEFAULT_AVATAR
+from config import DEFAULT_AVATAR
 from uuid import uuid3, NAMESPACE_URL
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 
 class TeamItem(fields.Raw):
@@ -20,23 +23,61 @@ class TeamItem(fields.Raw):
         return value.tid
 
 
+class AvatarUrl(AffixUrl):
+    """头像链接，size 为 AVATAR_SIZES 之一时指向该尺寸的缩略图"""
+
+    arg = 'avatar'
+
+    def __init__(self, size=None, **kwargs):
+        super().__init__('main.get_avatar', absolute=True, **kwargs)
+        self.size = size
+
+    def values(self):
+        return {'size': self.size}
+
+
 user_fields = {
     'id': fields.Integer,
     'username': fields.String,
     'name': fields.String,
-    'avatar': fields.Url('main.get_avatar', attribute='avatar', absolute=True),
+    'avatar': AvatarUrl(256, attribute='avatar'),
     'email': fields.String,
     'team_id': fields.List(TeamItem, attribute='teams')  # , default=[]
 }
 
+email_t = inputs.regex(r'^[0-9a-zA-Z_-]+@[0-9a-zA-Z_-]+(?:.[0-9a-zA-Z_-]+){1,2}$')
+username_t = inputs.regex(r'^[0-9a-zA-Z\u4e00-\u9fa5]{2,16}$')  # 不能跟email混淆
+
+users_get_parser = RequestParser()
+users_get_parser.add_argument('id', type=int, required=False, location=['json', 'args'])
+users_get_parser.add_argument('username', type=str, required=False, location=['json', 'args'])
+
+users_post_parser = RequestParser()
+users_post_parser.add_argument('email', type=email_t, required=True, help='为空或不合法', location='json')
+users_post_parser.add_argument('username', type=username_t, required=True, help='为空或不合法', location='json')
+users_post_parser.add_argument('password', type=str, required=True, help='密码不能为空', location='json')
+users_post_parser.add_argument('name', type=str, required=False, help='不填则默认为username', location='json')
+
+users_patch_parser = RequestParser()
+users_patch_parser.add_argument('name', type=str, required=False, location='json')
+users_patch_parser.add_argument('email', type=email_t, required=False, location='json')
+
+password_parser = RequestParser()
+password_parser.add_argument('password', type=str, required=True, help='密码不能为空', location='json')
+password_parser.add_argument('password2', type=str, required=True, help='新密码不能为空', location='json')
+
+avatar_parser = RequestParser()
+avatar_parser.add_argument('avatar', type=FileStorage, required=True, location='files')
+
 
 class TokenAPI(Resource):
     decorators = [auth.login_required]
 
     def get(self):
         # 双令牌无感知刷新
-        access_token = g.current_user.generate_auth_token(expiration=24*60*60)
-        refresh_token = g.current_user.generate_auth_token(expiration=30*24*3600)
+        user = g.current_user.user
+        access_token = user.generate_auth_token(expiration=24*60*60)
+        refresh_token = user.generate_auth_token(expiration=30*24*3600)
 
         response = {'code': 0, 'message': '', 'data': {}}
         response['data']['access_token'] = access_token.decode('ascii')
@@ -47,34 +88,23 @@ class TokenAPI(Resource):
 class UserListAPI(Resource):
     method_decorators = {'get': [auth.login_required], 'patch': [auth.login_required]}
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        super().__init__()
-
     def get(self):  # 依据id/username查询用户，或返回当前用户
-        self.reqparse.add_argument('id', type=int, required=False, location=['json', 'args'])
-        self.reqparse.add_argument('username', type=str, required=False, location=['json', 'args'])
-        args = self.reqparse.parse_args(strict=True)
+        args = users_get_parser.parse_args(strict=True)
+        query = User.query.options(joinedload(User.teams).load_only('id'))  # team_id 只需团队id，随用户一并取出
 
-        user = User.query.get(args.id)
-        user = user or User.query.filter_by(username=args['username']).first()
+        user = query.get(args.id) if args.id else None
+        if user is None and args['username']:
+            user = query.filter_by(username=args['username']).first()
 
         if not user:
-            user = User(avatar=DEFAULT_AVATAR) if args.id else g.current_user
+            user = User(avatar=DEFAULT_AVATAR) if args.id else query.get(g.current_user.id)
         # user = user or g.current_user
 
         response = {'code': 0, 'message': '', 'data': marshal(user, user_fields)}
         return response, 200
 
     def post(self):
-        email_t = inputs.regex(r'^[0-9a-zA-Z_-]+@[0-9a-zA-Z_-]+(?:.[0-9a-zA-Z_-]+){1,2}$')
-        username_t = inputs.regex(r'^[0-9a-zA-Z\u4e00-\u9fa5]{2,16}$')  # 不能跟email混淆
-
-        self.reqparse.add_argument('email', type=email_t, required=True, help='为空或不合法', location='json')
-        self.reqparse.add_argument('username', type=username_t, required=True, help='为空或不合法', location='json')
-        self.reqparse.add_argument('password', type=str, required=True, help='密码不能为空', location='json')
-        self.reqparse.add_argument('name', type=str, required=False, help='不填则默认为username', location='json')
-        args = self.reqparse.parse_args(strict=True)
+        args = users_post_parser.parse_args(strict=True)
 
         email = args.email
         username = args['username']
@@ -96,15 +126,20 @@ class UserListAPI(Resource):
     def patch(self):  # 登录即可确认身份，故不需id
         """修改用户名、邮箱"""
 
-        email_t = inputs.regex(r'^[0-9a-zA-Z_-]+@[0-9a-zA-Z_-]+(?:.[0-9a-zA-Z_-]+){1,2}$')
-        self.reqparse.add_argument('name', type=str, required=False, location='json')
-        self.reqparse.add_argument('email', type=email_t, required=False, location='json')
-        args = self.reqparse.parse_args(strict=True)
+        args = users_patch_parser.parse_args(strict=True)
 
-        user = g.current_user
+        user = g.current_user.user
         object_alter(user, args)
         db.session.add(user)
-        db.session.commit()
+        try:
+            if args.name is not None:
+                Team.touch_joined(user.id)  # 团队成员列表中有name；批量更新前会先flush，邮箱冲突可能在此抛出
+            db.session.commit()
+        except IntegrityError:
+            # email 有唯一索引
+            db.session.rollback()
+            raise UserAlreadyExistsError('该邮箱已被使用')
+        token_cache.discard_user(user.id)
 
         response = {'code': 0, 'message': '', 'data': marshal(user, user_fields)}
         return response, 200
@@ -113,15 +148,9 @@ class UserListAPI(Resource):
 class UserPwdAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('password', type=str, required=True, help='密码不能为空', location='json')
-        self.reqparse.add_argument('password2', type=str, required=True, help='新密码不能为空', location='json')
-        super().__init__()
-
     def put(self):
-        args = self.reqparse.parse_args(strict=True)
-        user = g.current_user
+        args = password_parser.parse_args(strict=True)
+        user = g.current_user.user
 
         if not user.verify_password(args['password']):
             raise IncorrectPasswordError()
@@ -129,6 +158,7 @@ class UserPwdAPI(Resource):
         user.hash_password(args['password2'])
         db.session.add(user)
         db.session.commit()
+        token_cache.discard_user(user.id)
 
         response = {'code': 0, 'message': '', 'data': marshal(user, user_fields)}
         return response, 200
@@ -137,29 +167,29 @@ class UserPwdAPI(Resource):
 class UserAvatarsAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('avatar', type=FileStorage, required=True, location='files')
-        super().__init__()
-
     def put(self):
-        user = g.current_user
-        args = self.reqparse.parse_args(strict=True)
-        f_name = user.avatar
-
-        if f_name and f_name != DEFAULT_AVATAR:
-            remove(Config.UPLOADED_FILES_DEST + f'img/{f_name}')
+        user = g.current_user.user
+        args = avatar_parser.parse_args(strict=True)
+        old = user.avatar
 
         avatar = args['avatar']
-        ext = extension(avatar.filename)
+        ext = extension(avatar.filename).lower()
+        if not up_files.extension_allowed(ext):
+            raise BadRequestError('头像仅支持 ' + '/'.join(up_files.extensions))
 
-        if f_name == DEFAULT_AVATAR:  # 节约计算，但username不能再变
+        if not old or old == DEFAULT_AVATAR:  # 节约计算，但username不能再变
             f_name = uuid3(NAMESPACE_URL, user.username).hex
             f_name = f'{f_name}.{ext}'
         else:
-            f_name = f_name[:-3] + ext
-
-        up_files.save(avatar, name=f'img/{f_name}')
+            f_name = old.rsplit('.', 1)[0] + '.' + ext
+
+        storage.save(avatar, f'img/{f_name}')
+        thumbnails.render_later(f_name)
+        if old and old not in (DEFAULT_AVATAR, f_name):
+            for name in [old] + thumbnails.names(old):
+                storage.remove(f'img/{name}')  # 后缀变了，旧文件不会被覆盖
+        if f_name != old:
+            Team.touch_joined(user.id)
         user.avatar = f_name
         db.session.add(user)
         db.session.commit()
@@ -1,7 +1,14 @@
-from app import db
+from app import db, storage, thumbnails
+from app.models import Archive, User
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager
 from Zenigame import app
+from config import ARCHIVE_BLOB_DIR, DEFAULT_AVATAR
+from os import listdir, path, remove, stat
+from time import time
+from io import BytesIO
+from sqlalchemy.orm import undefer
+from werkzeug.datastructures import FileStorage
 """
 先激活虚拟环境，因为虚拟环境才有所需模块
 再切到 manage.py 所在目录并打开数据库
@@ -18,5 +25,64 @@ migrate = Migrate(app, db)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def dedup_archives(grace=3600):
+    """
+    把已有的Archive并入按内容去重的blob存储(文本类从content列移出)，并清理无人引用的blob
+    grace 秒内有变动(新建或被链接)、或仍有硬链接指向的blob不清理，以免删掉正在上传、尚未查到记录的
+    """
+
+    texts = Archive.query.filter(Archive.type.in_((1, 2)), Archive.blob.is_(None)).options(undefer('content'))
+    moved = 0
+    while True:
+        batch = texts.limit(100).all()  # 分批加载正文，提交后已迁移的不再被查出
+        if not batch:
+            break
+        for a in batch:
+            text = FileStorage(BytesIO((a.content or '').encode()), a.filename)
+            a.blob = storage.save_blob(text, f'archives/{a.filename}', ARCHIVE_BLOB_DIR)
+            a.content = None
+        db.session.commit()  # 提交后文件才落到blob目录
+        moved += len(batch)
+    print(f'移出文本 {moved} 个')
+
+    merged = missing = 0
+    for a in Archive.query.filter(Archive.type == 3).yield_per(200):
+        blob = storage.dedup(f'archives/{a.filename}', ARCHIVE_BLOB_DIR)
+        if blob is None:
+            missing += 1
+        elif blob != a.blob:
+            a.blob = blob
+            merged += 1
+    db.session.commit()
+
+    used = {r.blob for r in db.session.query(Archive.blob).filter(Archive.blob.isnot(None)).distinct()}
+    blob_dir = storage.path(ARCHIVE_BLOB_DIR)
+    deadline = time() - int(grace)
+    orphans = []
+    for b in listdir(blob_dir) if path.isdir(blob_dir) else []:
+        info = stat(path.join(blob_dir, b))
+        # 硬链接增减也会更新ctime
+        if b not in used and info.st_nlink == 1 and info.st_ctime < deadline:
+            orphans.append(b)
+    for b in orphans:
+        remove(path.join(blob_dir, b))
+    print(f'并入 {merged} 个，文件缺失 {missing} 个，清理blob {len(orphans)} 个')
+
+
+@manager.command
+def render_avatars():
+    """为已有头像(含默认头像)生成各尺寸缩略图"""
+
+    avatars = {r.avatar for r in db.session.query(User.avatar).filter(User.avatar.isnot(None)).distinct()}
+    avatars.add(DEFAULT_AVATAR)
+    done = 0
+    for avatar in avatars:
+        if path.isfile(storage.path(f'img/{avatar}')):
+            thumbnails.render(avatar)
+            done += 1
+    print(f'生成 {done} 个头像的缩略图')
+
+
 if __name__ == '__main__':
     manager.run()
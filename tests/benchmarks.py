@@ -0,0 +1,231 @@
+"""
+性能基准，不随 pytest 运行，于项目根目录执行：
+python -m tests.benchmarks [token questionnaire chat parsers marshal pubsub]  不给名字则全部运行
+均以内存SQLite与Flask测试客户端运行，数字只用于同一台机器上前后对比
+"""
+
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+from app import db, socketio
+from app.models import User, Team
+from .helpers import create_test_app, register, count_queries
+
+app = create_test_app(mkdtemp(prefix='zenigame-bench-'))
+
+
+def timeit(f, n):
+    """返回每次调用的平均秒数"""
+    t0 = perf_counter()
+    for _ in range(n):
+        f()
+    return (perf_counter() - t0) / n
+
+
+def setup_team(client):
+    headers = {name: register(client, name) for name in ('alice', 'bobby')}
+    client.post('/v1/teams', headers=headers['alice'], json={'name': 't', 'check_s': '00:00', 'check_e': '23:59'})
+    client.post('/v1/teams/1', headers=headers['alice'], json={'action': 1, 'uid': 2})
+    return headers
+
+
+def reset():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+
+def bench_token(n=2000):
+    """令牌认证缓存(user-001)：缓存关闭(每次验签并查users) 与 开启 的请求速率"""
+
+    from app.v1.decorators import token_cache
+
+    reset()
+    client = app.test_client()
+    headers = setup_team(client)['alice']
+
+    def get():
+        return client.get('/v1/teams/1/logs', headers=headers)
+
+    maxsize = token_cache.maxsize
+    for label, size in (('uncached', 0), ('cached', maxsize)):
+        token_cache.clear()
+        token_cache.maxsize = size
+        get()
+        print(f'token {label:9s} {1 / timeit(get, n):7.0f} req/s')
+    token_cache.maxsize = maxsize
+
+
+def bench_questionnaire(n=30, questions=50, options=5):
+    """批量插入(user-008)：50题x5选项问卷的创建与作答，每请求耗时与SQL语句数"""
+
+    reset()
+    client = app.test_client()
+    headers = setup_team(client)
+    qs = [{'qid': i, 'desc': f'q{i}', 'type': 1 + i % 2,
+           'options': [{'oid': k, 'desc': f'o{k}'} for k in range(1, options + 1)]} for i in range(1, questions + 1)]
+    answers = [{'qid': i, 'type': 1 + i % 2, 'ans': [1, 3] if i % 2 else 2} for i in range(1, questions + 1)]
+    body = {'title': 'b', 'deadline': '2099-01-01T00:00:00', 'questions': qs}
+
+    with app.app_context():
+        engine = db.engine
+
+    ids = []
+
+    def create():
+        rv = client.post('/v1/teams/1/questionnaires', headers=headers['alice'], json=body)
+        assert rv.status_code == 201, rv.get_json()
+        ids.append(rv.get_json()['data']['id'])
+
+    def submit():
+        rv = client.post(f'/v1/questionnaires/{ids.pop()}', headers=headers['bobby'], json={'answers': answers})
+        assert rv.status_code == 201, rv.get_json()
+
+    for label, f in (('create', create), ('submit', submit)):
+        with count_queries(engine) as q:
+            t = timeit(f, n)
+        print(f'questionnaire {label:6s} {t * 1000:6.1f} ms/req {len(q) / n:5.0f} statements/req')
+
+
+def bench_chat(clients=50, messages=500, window=50):
+    """聊天合并转发(user-013)：逐条转发 与 合并窗口 下各客户端收到的包数"""
+
+    from app.main import sockets
+
+    reset()
+    with app.app_context():
+        user = User(email='a@x.com', username='alice', name='a')
+        user.hash_password('pw')
+        team = Team(name='t', leader=1)
+        team.users.append(user)
+        db.session.add(team)
+        db.session.commit()
+        token = user.generate_auth_token().decode()
+
+    batcher = sockets.chat_batcher
+    for w in (0, window):
+        sockets.chat_batcher = sockets.ChatBatcher(w) if w > 0 else None
+        conns = [socketio.test_client(app, namespace='/chat', query_string='token=' + token) for _ in range(clients)]
+        for c in conns:
+            c.emit('join', {'tid': 1}, namespace='/chat')
+        for c in conns:
+            c.get_received('/chat')
+
+        t0 = perf_counter()
+        for i in range(messages):
+            conns[i % clients].emit('chat', {'tid': 1, 'msg': i}, namespace='/chat')
+            if i % clients == clients - 1:
+                socketio.sleep(0)
+        socketio.sleep(w / 1000 + 0.1)
+        t = perf_counter() - t0
+
+        packets = [p for c in conns for p in c.get_received('/chat')]
+        delivered = sum(len(p['args'][0]) if p['name'] == 'chat_batch' else 1 for p in packets)
+        print(f'chat window={w:3d}ms packets={len(packets):6d} messages={delivered:6d} {t:.2f}s')
+        for c in conns:
+            c.disconnect('/chat')
+    sockets.chat_batcher = batcher
+
+
+def bench_parsers(n=20000):
+    """模块级请求解析器(user-021)：每请求新建 RequestParser 再解析 与 复用模块级解析器 的单次耗时"""
+
+    from flask_restful import reqparse
+    from app.v1 import tasks, users, schedules, teams
+
+    def rebuild(parser):
+        """旧做法：每个请求都 new RequestParser 并逐个 add_argument"""
+        def parse():
+            p = reqparse.RequestParser()
+            for a in parser.args:
+                p.add_argument(reqparse.Argument(**vars(a)))
+            return p.parse_args(strict=True)
+        return parse
+
+    cases = [
+        ('tasks get', tasks.tasks_get_parser, {'path': '/?status=1&page=2'}),
+        ('users post', users.users_post_parser, {'json': {'email': 'a@b.com', 'username': 'abc', 'password': 'x'}}),
+        ('schedules post', schedules.schedules_post_parser,
+         {'json': {'desc': 'd', 'urgency': 1, 'start': '2026-10-01', 'end': '2026-10-02'}}),
+        ('team post', teams.team_post_parser, {'json': {'action': 1, 'uid': 2}}),
+    ]
+    for name, parser, kw in cases:
+        with app.test_request_context(method='POST', **kw):
+            def shared():
+                return parser.parse_args(strict=True)
+            assert rebuild(parser)() == shared()
+            old, new = timeit(rebuild(parser), n), timeit(shared, n)
+        print(f'parsers {name:15s} per-request {old * 1e6:6.1f} us  module-level {new * 1e6:6.1f} us')
+
+
+def per_item_urls(spec):
+    """把字段表中的 AffixUrl 换成逐项 url_for 的等价字段，即预编译之前的做法"""
+
+    from flask import url_for
+    from flask_restful import fields
+    from app.v1.serializers import AffixUrl
+
+    class PerItemUrl(fields.Raw):
+        def __init__(self, field):
+            super().__init__()
+            self.field = field
+
+        def output(self, key, obj):
+            f = self.field
+            value = getattr(obj, key if f.attribute is None else f.attribute)
+            return url_for(f.endpoint_for(obj), _external=f.absolute, **{f.arg: value}, **f.values())
+
+    def convert(field):
+        if isinstance(field, AffixUrl):
+            return PerItemUrl(field)
+        if isinstance(field, fields.List) and isinstance(field.container, fields.Nested):
+            return fields.List(fields.Nested(per_item_urls(field.container.nested)), attribute=field.attribute)
+        return field
+
+    return {k: convert(v) for k, v in spec.items()}
+
+
+def bench_marshal(members=100, n=500):
+    """预编译序列化(user-022)：100名成员的 team_fields，逐项 url_for 的 flask_restful.marshal 与 serializers.marshal"""
+
+    from flask_restful import marshal as restful_marshal
+    from app.v1.serializers import marshal
+    from app.v1.teams import team_fields, Member, TeamDetail
+
+    team = Team(id=1, name='t', desc='d', leader=1, inv_code='aZ_0-9+x')
+    detail = TeamDetail(team, [Member(i, f'user {i}', f'{i} +%.jpg') for i in range(1, members + 1)])
+    old_fields = per_item_urls(team_fields)
+
+    with app.test_request_context():
+        assert marshal(detail, team_fields) == restful_marshal(detail, old_fields)
+        old = timeit(lambda: restful_marshal(detail, old_fields), n)
+        new = timeit(lambda: marshal(detail, team_fields), n)
+    print(f'marshal team x{members} flask_restful {old * 1000:6.2f} ms  compiled {new * 1000:6.2f} ms')
+
+
+def bench_pubsub(messages=5000):
+    """多进程广播(user-011)：一个进程经 LocalSocketManager 发布，各订阅进程都收到全部消息时的总投递速率"""
+
+    from .test_pubsub import fan_out
+
+    for processes in (1, 2, 4, 8):
+        url = f'local://{mkdtemp(prefix="zenigame-sio-")}/sio'
+        stats = fan_out(url, processes, messages)
+        delivered = sum(got for got, _ in stats)
+        assert delivered == processes * messages
+        print(f'pubsub processes={processes} {delivered / max(t for _, t in stats):9.0f} deliveries/s')
+
+
+BENCHMARKS = {
+    'token': bench_token,
+    'questionnaire': bench_questionnaire,
+    'chat': bench_chat,
+    'parsers': bench_parsers,
+    'marshal': bench_marshal,
+    'pubsub': bench_pubsub,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,51 @@
+import pytest
+
+from .helpers import create_test_app, register, count_queries
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    return create_test_app(tmp_path_factory.mktemp('static'))
+
+
+@pytest.fixture
+def db(app):
+    """每个测试一个空库，进程内缓存一并清空；请求之外访问数据库需自行进入 app.app_context()"""
+
+    from app import db, response_cache
+    from app.v1.decorators import token_cache
+
+    with app.app_context():
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    token_cache.clear()
+    response_cache.clear()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def users(client):
+    """alice(队长)、bobby 同在团队1，carol 不在；返回 {用户名: 请求头}"""
+
+    headers = {name: register(client, name) for name in ('alice', 'bobby', 'carol')}
+    rv = client.post('/v1/teams', headers=headers['alice'], json={'name': 't', 'check_s': '00:00', 'check_e': '23:59'})
+    assert rv.status_code == 201
+    rv = client.post('/v1/teams/1', headers=headers['alice'], json={'action': 1, 'uid': 2})
+    assert rv.status_code == 200
+    return headers
+
+
+@pytest.fixture
+def queries(app, db):
+    """with queries() as q: ... 之后 len(q) 为其间执行的SQL语句数"""
+
+    with app.app_context():
+        engine = db.engine
+    return lambda: count_queries(engine)
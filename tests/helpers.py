@@ -0,0 +1,82 @@
+"""
+测试与基准共用：以内存SQLite代替MySQL创建应用，及请求/计数的辅助函数
+"""
+
+from base64 import b64encode
+from contextlib import contextmanager
+from os import makedirs, path
+
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import TINYINT
+from sqlalchemy.dialects.mysql.dml import OnDuplicateClause
+from sqlalchemy.ext.compiler import compiles
+
+import config
+
+
+@compiles(TINYINT, 'sqlite')
+def _tinyint(element, compiler, **kw):
+    return 'INTEGER'
+
+
+@compiles(OnDuplicateClause, 'sqlite')
+def _on_duplicate(clause, compiler, **kw):
+    # MySQL 的 ON DUPLICATE KEY UPDATE 在SQLite中对应主键冲突时的 upsert
+    pk = ','.join(col.name for col in compiler.statement.table.primary_key)
+    sets = ', '.join(f'{k} = ' + compiler.process(v, **kw) for k, v in clause.update.items())
+    return f'ON CONFLICT({pk}) DO UPDATE SET ' + sets
+
+
+def create_test_app(upload_dir, db_uri='sqlite://'):
+    """upload_dir 为存放上传文件的临时目录，返回已建表的应用"""
+
+    for sub in ('img', 'archives'):
+        makedirs(path.join(upload_dir, sub), exist_ok=True)
+    config.Config.SQLALCHEMY_DATABASE_URI = db_uri
+    config.Config.UPLOADED_FILES_DEST = str(upload_dir).rstrip('/') + '/'
+    config.Config.SOCKETIO_MESSAGE_QUEUE = None
+    config.Config.PRESENCE_REDIS_URL = None
+    config.Config.RESPONSE_CACHE_REDIS_URL = None
+
+    from app import create_app, db
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def basic_auth(username, password='pw'):
+    return {'Authorization': 'Basic ' + b64encode(f'{username}:{password}'.encode()).decode()}
+
+
+def register(client, username, password='pw'):
+    """注册用户并返回其令牌认证的请求头"""
+
+    rv = client.post('/v1/users', json={'email': f'{username}@x.com', 'username': username, 'password': password})
+    assert rv.status_code == 201, rv.get_json()
+    rv = client.get('/v1/users/token', headers=basic_auth(username, password))
+    return {'Authorization': 'Bearer ' + rv.get_json()['data']['access_token']}
+
+
+class QueryCounter(object):
+    """记录 engine 上执行的SQL语句"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._record)
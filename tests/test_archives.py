@@ -0,0 +1,40 @@
+import os
+
+import eventlet
+import pytest
+
+from app import db, storage
+from app.models import Archive
+
+
+@pytest.fixture
+def task(client, users):
+    rv = client.post('/v1/teams/1/tasks', headers=users['alice'],
+                     json={'title': 't', 'assignee': 2, 'deadline': '2099-01-01T00:00:00'})
+    assert rv.status_code == 201, rv.get_json()
+    return rv.get_json()['data']['id']
+
+
+def test_text_archive_served_from_its_own_link(client, users, task):
+    rv = client.post(f'/v1/tasks/{task}', headers=users['bobby'],
+                     json={'type': 1, 'name': 'n', 'text': '# hi', 'finish': False})
+    assert rv.status_code == 201, rv.get_json()
+    url = rv.get_json()['data']['archives'][0]['archive_url']
+
+    rv = client.get(url, headers=users['alice'])
+    assert rv.data == b'# hi'
+    assert client.get(url, headers=dict(users['alice'], **{'If-None-Match': rv.headers['ETag']})).status_code == 304
+
+
+def test_delete_task_removes_legacy_files(app, client, users, task):
+    with app.app_context():
+        db.session.add(Archive(name='old', type=3, filename='legacy.doc', owner=2, team_id=1, task_id=task))
+        db.session.commit()
+        legacy = storage.path('archives/legacy.doc')
+    with open(legacy, 'wb') as f:
+        f.write(b'legacy')
+
+    rv = client.delete(f'/v1/tasks/{task}', headers=users['alice'])
+    assert rv.status_code == 200, rv.get_json()
+    eventlet.sleep(0.1)  # 文件在后台删除
+    assert not os.path.exists(legacy)
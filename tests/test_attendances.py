@@ -0,0 +1,53 @@
+from datetime import date
+
+import pytest
+
+
+@pytest.fixture
+def punched(client, users):
+    """alice、bobby 今天各打卡一次"""
+
+    for name in ('alice', 'bobby'):
+        rv = client.post('/v1/teams/1/attendances', headers=users[name])
+        assert rv.status_code == 201, rv.get_json()
+    return date.today()
+
+
+def test_punch_in_once_per_day(client, users, punched):
+    rv = client.post('/v1/teams/1/attendances', headers=users['bobby'])
+    assert rv.status_code == 403
+    assert rv.get_json()['message'] == '不可重复打卡'
+
+    rv = client.post('/v1/teams/1/attendances', headers=users['carol'])
+    assert rv.status_code == 403
+
+
+def test_daily_stats(client, users, punched):
+    url = f'/v1/teams/1/attendances?date={punched.isoformat()}'
+    data = client.get(url, headers=users['bobby']).get_json()['data']
+    assert data['present'] == 2
+    assert 0 <= data['punctual'] <= 2  # 23:59之后打卡不算准时
+
+    rv = client.get(url + '&spec=true', headers=users['alice'])
+    assert sorted(a['uid'] for a in rv.get_json()['data']) == [1, 2]
+
+    rv = client.get(url + '&self=true', headers=users['bobby'])
+    assert rv.get_json()['data']['uid'] == 2
+
+
+def test_monthly_stats(client, users, punched):
+    url = f'/v1/teams/1/attendances/stats?year={punched.year}&month={punched.month}'
+    rv = client.get(url, headers=users['bobby'])
+    data = rv.get_json()['data']
+    assert len(data) == 1
+    assert data[0]['date'].startswith(punched.isoformat())
+    assert data[0]['present'] == 2
+
+    rv = client.get('/v1/teams/1/attendances/stats?year=9999&month=12', headers=users['bobby'])
+    assert rv.status_code == 200 and rv.get_json()['data'] == []
+
+
+@pytest.mark.parametrize('query', ['year=10000&month=1', 'year=0&month=1', 'year=2026&month=13'])
+def test_monthly_stats_rejects_out_of_range(client, users, query):
+    rv = client.get('/v1/teams/1/attendances/stats?' + query, headers=users['bobby'])
+    assert rv.status_code == 400
@@ -0,0 +1,24 @@
+import logging
+
+from app import response_cache
+
+
+def test_team_responses_cached_by_version(client, users):
+    for _ in range(3):
+        assert client.get('/v1/teams/1', headers=users['bobby']).status_code == 200
+    client.patch('/v1/teams/1', headers=users['alice'], json={'desc': 'changed'})
+    rv = client.get('/v1/teams/1', headers=users['bobby'])
+
+    assert rv.get_json()['data']['desc'] == 'changed'
+    assert response_cache.stats()['team'] == {'hits': 2, 'misses': 2, 'hit_rate': 0.5}
+
+
+def test_stats_logged_periodically(client, users, caplog, monkeypatch):
+    monkeypatch.setattr(response_cache, 'log_every', 2)
+    caplog.set_level(logging.INFO, logger='app')
+    for _ in range(4):
+        client.get('/v1/teams/1', headers=users['bobby'])
+
+    logged = [r.getMessage() for r in caplog.records if r.getMessage().startswith('response cache')]
+    assert len(logged) == 2
+    assert "'team': {'hits': 2, 'misses': 1" in logged[-1]  # 记日志时第4次查询尚未计入
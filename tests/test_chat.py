@@ -0,0 +1,70 @@
+import pytest
+
+from app import socketio
+
+
+def events(client, name):
+    return [p['args'][0] for p in client.get_received('/chat') if p['name'] == name]
+
+
+@pytest.fixture
+def connect(app, users):
+    clients = []
+
+    def connect(username):
+        token = users[username]['Authorization'].split()[1]
+        client = socketio.test_client(app, namespace='/chat', query_string='token=' + token)
+        clients.append(client)
+        return client
+
+    yield connect
+    for c in clients:
+        if c.is_connected('/chat'):
+            c.disconnect('/chat')
+
+
+def test_repeated_join_is_idempotent(connect):
+    alice, bobby = connect('alice'), connect('bobby')
+    alice.emit('join', {'tid': 1}, namespace='/chat')
+    alice.get_received('/chat')
+
+    bobby.emit('join', {'tid': 1}, namespace='/chat')
+    bobby.emit('join', {'tid': 1}, namespace='/chat')
+    assert events(alice, 'enter') == [{'uid': 2}]
+    assert events(bobby, 'online') == [{'tid': 1, 'uids': [1, 2]}] * 2
+
+    bobby.emit('leave', {'tid': 1}, namespace='/chat')
+    assert events(alice, 'exit') == [{'uid': 2}]
+
+
+def test_join_rechecks_membership(client, users, connect):
+    bobby = connect('bobby')
+    bobby.emit('join', {'tid': 1}, namespace='/chat')
+    assert events(bobby, 'online')
+    bobby.emit('leave', {'tid': 1}, namespace='/chat')
+
+    rv = client.post('/v1/teams/1', headers=users['alice'], json={'action': 2, 'uid': 2})
+    assert rv.status_code == 200, rv.get_json()
+    bobby.emit('join', {'tid': 1}, namespace='/chat')
+    assert events(bobby, 'online') == []
+
+
+def test_join_uses_memberships_loaded_at_connect(connect, queries):
+    bobby = connect('bobby')
+    with queries() as q:
+        for _ in range(3):
+            bobby.emit('join', {'tid': 1}, namespace='/chat')
+            bobby.emit('leave', {'tid': 1}, namespace='/chat')
+    assert len(q) == 0
+    assert len(events(bobby, 'online')) == 3
+
+
+def test_join_after_being_added(client, users, connect):
+    carol = connect('carol')
+    carol.emit('join', {'tid': 1}, namespace='/chat')
+    assert events(carol, 'online') == []
+
+    rv = client.post('/v1/teams/1', headers=users['alice'], json={'action': 1, 'uid': 3})
+    assert rv.status_code == 200, rv.get_json()
+    carol.emit('join', {'tid': 1}, namespace='/chat')
+    assert events(carol, 'online') == [{'tid': 1, 'uids': [3]}]
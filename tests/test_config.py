@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def password_rounds(**env):
+    """在子进程中按给定环境变量读取配置(配置在导入时求值)"""
+
+    env = dict(os.environ, **env)
+    for name in ('PASSWORD_SCHEMES', 'PASSWORD_ROUNDS'):
+        if env.get(name) is None:
+            env.pop(name, None)
+    out = subprocess.run([sys.executable, '-c', 'import config; print(config.Config.PASSWORD_ROUNDS)'],
+                         env=env, capture_output=True, text=True, check=True)
+    return out.stdout.strip()
+
+
+@pytest.mark.parametrize('schemes, rounds, expected', [
+    (None, None, '29000'),
+    ('bcrypt,pbkdf2_sha256', None, 'None'),  # pbkdf2的迭代次数不能当作bcrypt的代价
+    ('bcrypt', '12', '12'),
+    ('pbkdf2_sha256', '50000', '50000'),
+])
+def test_password_rounds_follow_first_scheme(schemes, rounds, expected):
+    assert password_rounds(PASSWORD_SCHEMES=schemes, PASSWORD_ROUNDS=rounds) == expected
@@ -0,0 +1,58 @@
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.main.sockets import MessageBuffer
+from app.models import Message
+
+
+def buffer(app, **kw):
+    buf = MessageBuffer(**kw)
+    buf._app = app  # 不启动后台定时写入，由测试调用 flush
+    return buf
+
+
+def stored(app):
+    with app.app_context():
+        return [m.content for m in Message.query.order_by(Message.id)]
+
+
+def test_bad_rows_dropped_rest_written(app, users):
+    buf = buffer(app)
+    buf.push(1, 1, 'a')
+    buf.push(1, 2, None)  # content 不可为NULL，整批写入失败
+    buf.push(1, 2, 'b')
+    buf.flush()
+
+    assert stored(app) == ['a', 'b']
+    assert buf._pending == []
+
+
+def test_transient_errors_retried_then_dropped(app, users, monkeypatch):
+    buf = buffer(app, retries=2)
+
+    def down(rows):
+        raise OperationalError('INSERT', {}, Exception('server has gone away'))
+
+    buf.push(1, 1, 'a')
+    with monkeypatch.context() as m:
+        m.setattr(buf, '_insert', down)
+        for _ in range(2):
+            buf.flush()
+            assert len(buf._pending) == 1  # 留待重试
+        buf.push(1, 1, 'b')
+        buf.flush()
+        assert buf._pending == []  # 第3次失败，整批丢弃
+
+    buf.push(1, 1, 'c')
+    buf.flush()
+    assert stored(app) == ['c']
+
+
+def test_pending_is_bounded(app, users):
+    buf = buffer(app, size=100, max_pending=3)
+    for c in 'abcde':
+        buf.push(1, 1, c)
+    assert [r['content'] for r in buf._pending] == ['c', 'd', 'e']
+
+    buf.flush()
+    assert stored(app) == ['c', 'd', 'e']
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Log
+
+
+def walk(client, headers, url):
+    """沿 next_cursor 取完所有页，返回各页内容"""
+
+    pages, cursor = [], ''
+    while cursor is not None:
+        rv = client.get(f'{url}?cursor={cursor}', headers=headers)
+        assert rv.status_code == 200, rv.get_json()
+        data = rv.get_json()['data']
+        pages.append(data['logs'])
+        cursor = data['next_cursor']
+    return pages
+
+
+def test_cursor_pages_through_null_datetimes(app, client, users):
+    now = datetime.now()
+    with app.app_context():
+        # 历史数据中 datetime 可为NULL，且恰好落在页边界上
+        db.session.execute(Log.__table__.insert(), [
+            {'uid': 1, 'desc': f'log {i}', 'team_id': 1, 'datetime': now - timedelta(minutes=i) if i < 4 else None}
+            for i in range(12)
+        ])
+        db.session.commit()
+        expected = [log.desc for log in Log.query.filter_by(team_id=1)]
+
+    pages = walk(client, users['bobby'], '/v1/teams/1/logs')
+    got = [log['desc'] for page in pages for log in page]
+    assert len(pages) > 2
+    assert sorted(got) == sorted(expected)
+    assert got[-8:] == [f'log {i}' for i in range(11, 3, -1)]  # NULL排在最后，按id倒序
@@ -0,0 +1,72 @@
+"""LocalSocketManager：多个进程间的广播转发"""
+
+import os
+import pickle
+from multiprocessing import Process, Queue
+from time import sleep, perf_counter
+
+import pytest
+
+from app.pubsub import LocalSocketManager
+
+CHANNEL = 'test'
+
+
+def subscribe(url, expected, results):
+    """子进程：绑定一个socket，收满 expected 条后报告 (收到的条数, 首末条间隔秒数)"""
+
+    manager = LocalSocketManager(url, channel=CHANNEL)
+    messages = manager._listen()
+    next(messages)  # 第一条为开始信号
+    t0 = perf_counter()
+    got = sum(1 for _, m in zip(range(expected), messages) if m['method'] == 'emit')
+    results.put((got, perf_counter() - t0))
+
+
+def fan_out(url, processes, messages):
+    """processes 个订阅进程各自收到 messages 条广播，返回各进程的 (条数, 耗时)"""
+
+    publisher = LocalSocketManager(url, channel=CHANNEL, write_only=True)
+    results = Queue()
+    workers = [Process(target=subscribe, args=(url, messages, results), daemon=True) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    while len([n for n in os.listdir(url[len('local://'):]) if n.startswith(CHANNEL)]) < processes:
+        sleep(0.01)
+
+    publisher._publish({'method': 'start'})
+    for i in range(messages):
+        publisher._publish({'method': 'emit', 'event': 'chat', 'data': {'msg': i}, 'room': 1, 'namespace': '/chat'})
+
+    stats = [results.get(timeout=30) for _ in workers]
+    for w in workers:
+        w.join()
+    return stats
+
+
+def test_fan_out_reaches_every_process(tmp_path):
+    stats = fan_out(f'local://{tmp_path}/sio', 4, 500)
+    assert [got for got, _ in stats] == [500] * 4
+
+
+def test_socket_dir_must_be_private(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    with pytest.raises(ValueError):
+        LocalSocketManager(f'local://{shared}', channel=CHANNEL, write_only=True)
+
+    LocalSocketManager(f'local://{tmp_path}/private', channel=CHANNEL, write_only=True)
+    assert (tmp_path / 'private').stat().st_mode & 0o777 == 0o700
+
+
+def test_oversized_and_foreign_messages(tmp_path):
+    url = f'local://{tmp_path}/sio'
+    manager = LocalSocketManager(url, channel=CHANNEL)
+    publisher = LocalSocketManager(url, channel=CHANNEL, write_only=True)
+
+    publisher._publish({'method': 'emit', 'data': 'x' * (1 << 21)})  # 超过数据报上限，记日志而不抛出
+    publisher.sock.sendto(pickle.dumps({'method': 'emit'}), manager.addr)  # 不是json，丢弃
+    publisher._publish({'method': 'emit', 'data': 'ok'})
+
+    assert next(manager._listen()) == {'method': 'emit', 'data': 'ok'}
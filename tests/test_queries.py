@@ -0,0 +1,78 @@
+"""各列表/详情接口每页的SQL语句数应为常数，不随条目数增长(N+1)"""
+
+from app import response_cache
+from .helpers import register
+
+QUESTIONS = [
+    {'qid': 1, 'desc': 'q1', 'type': 1, 'options': [{'oid': 1, 'desc': 'a'}, {'oid': 2, 'desc': 'b'}]},
+    {'qid': 2, 'desc': 'q2', 'type': 3, 'options': []},
+]
+
+
+def create_questionnaires(client, headers, n):
+    ids = []
+    for i in range(n):
+        rv = client.post('/v1/teams/1/questionnaires', headers=headers,
+                         json={'title': f'q{i}', 'deadline': '2099-01-01T00:00:00', 'questions': QUESTIONS})
+        assert rv.status_code == 201, rv.get_json()
+        ids.append(rv.get_json()['data']['id'])
+    return ids
+
+
+def count_get(client, queries, url, headers):
+    client.get(url, headers=headers)  # 预热令牌缓存等
+    response_cache.clear()  # 计的是生成响应的查询
+    with queries() as q:
+        rv = client.get(url, headers=headers)
+    assert rv.status_code == 200, rv.get_json()
+    return len(q), rv.get_json()['data']
+
+
+def test_questionnaire_list(client, users, queries):
+    ids = create_questionnaires(client, users['alice'], 2)
+    for qid in ids[:1]:
+        rv = client.post(f'/v1/questionnaires/{qid}', headers=users['bobby'],
+                         json={'answers': [{'qid': 1, 'type': 1, 'ans': 2}]})
+        assert rv.status_code == 201, rv.get_json()
+
+    few, data = count_get(client, queries, '/v1/teams/1/questionnaires', users['bobby'])
+    assert [q['filled'] for q in data['questionnaire']] == [False, True]
+
+    ids += create_questionnaires(client, users['alice'], 7)  # 仍不满一页，两次都不需COUNT
+    for qid in ids[2:6]:
+        client.post(f'/v1/questionnaires/{qid}', headers=users['bobby'], json={'answers': []})
+
+    many, data = count_get(client, queries, '/v1/teams/1/questionnaires', users['bobby'])
+    assert sum(q['filled'] for q in data['questionnaire']) == 5
+    assert many == few <= 4
+
+
+def test_team_detail(client, users, queries):
+    few, data = count_get(client, queries, '/v1/teams/1', users['bobby'])
+    assert len(data['members']) == 2
+
+    for name in ('dave', 'erin', 'fred', 'gina'):
+        register(client, name)
+    for uid in range(4, 8):
+        assert client.post('/v1/teams/1', headers=users['alice'], json={'action': 1, 'uid': uid}).status_code == 200
+
+    many, data = count_get(client, queries, '/v1/teams/1', users['bobby'])
+    assert len(data['members']) == 6
+    assert many == few
+
+
+def test_task_list(client, users, queries):
+    def post_tasks(n):
+        for i in range(n):
+            rv = client.post('/v1/teams/1/tasks', headers=users['alice'],
+                             json={'title': f't{i}', 'assignee': 2, 'deadline': '2099-01-01T00:00:00'})
+            assert rv.status_code == 201, rv.get_json()
+
+    post_tasks(2)
+    few, data = count_get(client, queries, '/v1/teams/1/tasks', users['bobby'])
+    assert len(data['tasks']) == 2
+
+    post_tasks(7)
+    many, data = count_get(client, queries, '/v1/teams/1/tasks', users['bobby'])
+    assert len(data['tasks']) == 9
+    assert many == few
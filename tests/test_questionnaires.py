@@ -0,0 +1,75 @@
+import pytest
+
+QUESTIONS = [
+    {'qid': 1, 'desc': 'single', 'type': 1, 'options': [{'oid': 1, 'desc': 'a'}, {'oid': 2, 'desc': 'b'}]},
+    {'qid': 2, 'desc': 'multi', 'type': 2, 'options': [{'oid': 1, 'desc': 'a'}, {'oid': 2, 'desc': 'b'}]},
+    {'qid': 3, 'desc': 'text', 'type': 3},
+]
+
+
+@pytest.fixture
+def questionnaire(client, users):
+    rv = client.post('/v1/teams/1/questionnaires', headers=users['alice'],
+                     json={'title': 'q', 'deadline': '2099-01-01T00:00:00', 'questions': QUESTIONS})
+    assert rv.status_code == 201, rv.get_json()
+    return rv.get_json()['data']['id']
+
+
+@pytest.mark.parametrize('answer', [
+    {'qid': 1, 'type': 1, 'ans': [1]},
+    {'qid': 1, 'type': 1, 'ans': 'a'},
+    {'qid': 1, 'type': 1, 'ans': True},
+    {'qid': 2, 'type': 2, 'ans': 1},
+    {'qid': 2, 'type': 2, 'ans': ['1']},
+    {'qid': 3, 'type': 3, 'ans': 1},
+    {'qid': 3, 'type': 1, 'ans': 1},
+    {'qid': 9, 'type': 1, 'ans': 1},
+])
+def test_answer_must_match_question(client, users, questionnaire, answer):
+    rv = client.post(f'/v1/questionnaires/{questionnaire}', headers=users['bobby'], json={'answers': [answer]})
+    assert rv.status_code == 400, rv.get_json()
+
+
+def test_duplicate_answer_rejected(client, users, questionnaire):
+    answers = [{'qid': 1, 'type': 1, 'ans': 1}, {'qid': 1, 'type': 1, 'ans': 2}]
+    rv = client.post(f'/v1/questionnaires/{questionnaire}', headers=users['bobby'], json={'answers': answers})
+    assert rv.status_code == 400
+
+
+def test_records_and_summary(client, users, questionnaire):
+    answers = [{'qid': 1, 'type': 1, 'ans': 2}, {'qid': 2, 'type': 2, 'ans': [1, 2]}, {'qid': 3, 'type': 3, 'ans': 'x'}]
+    rv = client.post(f'/v1/questionnaires/{questionnaire}', headers=users['bobby'], json={'answers': answers})
+    assert rv.status_code == 201, rv.get_json()
+
+    rv = client.get(f'/v1/questionnaires/{questionnaire}/records', headers=users['alice'])
+    assert rv.get_json()['data'][0]['answers'] == answers
+
+    rv = client.get(f'/v1/questionnaires/{questionnaire}/records?format=csv', headers=users['alice'])
+    assert rv.get_data(as_text=True).splitlines()[1].endswith(',2,1;2,x')
+
+    rv = client.get(f'/v1/questionnaires/{questionnaire}/summary', headers=users['alice'])
+    assert rv.get_json()['data'] == [
+        {'qid': 1, 'options': [{'oid': 1, 'count': 0}, {'oid': 2, 'count': 1}]},
+        {'qid': 2, 'options': [{'oid': 1, 'count': 1}, {'oid': 2, 'count': 1}]},
+    ]
+
+
+def test_records_with_malformed_legacy_answers(app, client, users, questionnaire):
+    from app import db
+    from app.models import QRecord, QAnswer
+
+    with app.app_context():
+        record = QRecord(username='bobby', questionnaire_id=questionnaire)
+        db.session.add(record)
+        db.session.flush()
+        db.session.add_all([
+            QAnswer(record_id=record.id, qid=1, type=1, ans='abc'),  # 非json
+            QAnswer(record_id=record.id, qid=2, type=2, ans='2'),  # 多选却是单个值
+        ])
+        db.session.commit()
+
+    rv = client.get(f'/v1/questionnaires/{questionnaire}/records', headers=users['alice'])
+    assert [a['ans'] for a in rv.get_json()['data'][0]['answers']] == ['abc', 2]
+
+    rv = client.get(f'/v1/questionnaires/{questionnaire}/records?format=csv', headers=users['alice'])
+    assert rv.get_data(as_text=True).splitlines()[1].endswith(',abc,2,')